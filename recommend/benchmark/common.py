@@ -0,0 +1,117 @@
+import os
+import resource
+import shutil
+import subprocess
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+
+from util.setting import init_logger, parse_args
+
+
+def make_dataset(dataset: str, n_entity: int, n_triple: int, n_relation: int = 27, n_inter: int = 8, seed: int = 2021) -> str:
+    """Writing a synthetic encoding dataset under ../data/encoding/dataset.
+
+    Every system entity has n_inter interactions on average and kg triples link random
+    entities with random relations (27 relations as in encoding_parser.py). Relation ids are
+    shifted by 1 in the adjacency (0 is system interactions), while relation weights hold
+    n_relation rows, so that the last relation id is never drawn.
+    """
+    path = '../data/encoding/' + dataset
+    rng = np.random.RandomState(seed)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+    with open(path + '/entity2id.txt', 'w') as f:
+        f.write('%d\n' % n_entity)
+        f.write(''.join('%d %d\n' % (rng.randint(1 << 62), i) for i in range(n_entity)))
+
+    with open(path + '/relation2id.txt', 'w') as f:
+        f.write('%d\n' % n_relation)
+        f.write(''.join('relation_%d %d\n' % (i, i) for i in range(n_relation)))
+
+    kg = np.stack((rng.randint(n_entity, size=n_triple), rng.randint(n_entity, size=n_triple),
+                   rng.randint(n_relation - 1, size=n_triple)), axis=1)
+    with open(path + '/train2id.txt', 'w') as f:
+        f.write('%d\n' % n_triple)
+        np.savetxt(f, kg, fmt='%d')
+
+    with open(path + '/inter2id_0.txt', 'w') as f:
+        for e_id in rng.choice(n_entity, size=max(n_entity // 4, 1), replace=False):
+            neg_ids = rng.randint(n_entity, size=rng.randint(1, 2 * n_inter))
+            f.write('%d %s \n' % (e_id, ' '.join(str(neg_id) for neg_id in neg_ids)))
+
+    return path
+
+def remove_dataset(dataset: str) -> None:
+    """Removing a synthetic encoding dataset.
+    """
+    shutil.rmtree('../data/encoding/' + dataset, ignore_errors=True)
+
+@contextmanager
+def synthetic_dataset(dataset: str, n_entity: int, n_triple: int):
+    """Providing a synthetic encoding dataset (see make_dataset) removed on exit.
+    """
+    make_dataset(dataset, n_entity, n_triple)
+    try:
+        yield dataset
+    finally:
+        remove_dataset(dataset)
+
+def parse_sizes(default: list) -> list:
+    """Parsing benchmark sizes from the command line (default if none is given).
+    """
+    return [int(n) for n in sys.argv[1:]] or default
+
+def make_args(argv: list):
+    """Parsing driver arguments for benchmarks (warning-level logging, no dataset cache).
+    """
+    args = parse_args(argv + ['--no_cache'])
+    init_logger(30)
+
+    return args
+
+def build_model(argv: list) -> tuple:
+    """Building the data generator and the GNN model of driver arguments with fixed seeds.
+    """
+    import tensorflow as tf
+
+    from model.GNN import GNN
+    from util.data_loader import load_data_engine
+    from util.meta_data import MetaData
+
+    tf.reset_default_graph()
+    tf.set_random_seed(2021)
+    np.random.seed(2021)
+
+    args = make_args(argv)
+    meta_data = MetaData(args.dataset)
+    data_generator = load_data_engine(args, meta_data)
+    model = GNN(args=args, meta_data=meta_data)
+
+    return args, meta_data, data_generator, model
+
+def run_isolated(module: str, *run_args) -> str:
+    """Running a configuration in its own `python -m module --run ...` process.
+
+    Peak resident memory is not shared across configurations this way. Returns the last
+    line printed by the configuration (see report_run).
+    """
+    output = subprocess.check_output([sys.executable, '-m', module, '--run'] + [str(arg) for arg in run_args])
+    return output.decode().strip().splitlines()[-1]
+
+def dispatch_run(run) -> bool:
+    """Calling run with the arguments of a process started by run_isolated, if it is one.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(*sys.argv[2:])
+        return True
+
+    return False
+
+def report_run(*timings) -> None:
+    """Printing timings (s) and the peak resident memory (MB) of the current process.
+    """
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('\t'.join(['%.4f' % timing for timing in timings] + ['%.1f' % peak_mb]))
@@ -0,0 +1,71 @@
+"""Benchmarking startup time and peak memory of evaluating a trained model with and without --inference.
+
+A model with random weights is saved once; every configuration then runs in its own process
+the eval path of `driver.py --epoch 0 --pretrain 2 --show_test`: loading the dataset, building
+the model, restoring weights, refreshing attention and testing.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.inference [n_entity ...]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+
+import tempfile
+from time import time
+
+from benchmark.common import build_model, dispatch_run, parse_sizes, report_run, run_isolated, synthetic_dataset
+
+
+def evaluate(argv: list, model_path: str, save: bool) -> tuple:
+    """Timing the eval path of driver.py (or saving random weights into model_path if save is set).
+
+    Returns seconds to load data, build the model and restore it, and to test.
+    """
+    t1 = time()
+    import tensorflow as tf
+
+    from util.helper import ensureDir, get_weight_path
+    from util.model_eval import test
+
+    args, meta_data, data_generator, model = build_model(argv)
+    weight_path = get_weight_path(model_path, args)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load_graph_data(sess, meta_data)
+        if save:
+            ensureDir(weight_path)
+            tf.train.Saver().save(sess, weight_path)
+            return 0., 0.
+
+        tf.train.Saver().restore(sess, tf.train.latest_checkpoint(os.path.dirname(weight_path)))
+        startup = time() - t1
+
+        t2 = time()
+        model.update_attentive_A(sess)
+        test(sess, model, data_generator, args.threshold)
+
+    return startup, time() - t2
+
+def run(dataset: str, model_path: str, mode: str) -> None:
+    """Printing startup time, test time and peak resident memory (MB) of a single configuration.
+    """
+    argv = ['--dataset', dataset, '--epoch', '0', '--test_size', '0.99999', '--val_size', '0.0']
+    if mode == 'inference':
+        argv.append('--inference')
+    report_run(*evaluate(argv, model_path, mode == 'save'))
+
+def main() -> None:
+    if dispatch_run(run):
+        return
+
+    print('n_entity\tmode\tstartup(s)\ttest(s)\tpeak(MB)')
+    for n_entity in parse_sizes([100000, 1000000]):
+        with synthetic_dataset('bench_inference', n_entity, n_entity * 10) as dataset, \
+                tempfile.TemporaryDirectory() as model_path:
+            run_isolated('benchmark.inference', dataset, model_path, 'save')
+            for mode in ['train', 'inference']:
+                print('%d\t%s\t%s' % (n_entity, mode, run_isolated('benchmark.inference', dataset, model_path, mode)))
+
+if __name__ == '__main__':
+    main()
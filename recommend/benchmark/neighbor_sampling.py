@@ -0,0 +1,49 @@
+"""Benchmarking per-step GNN training time of full-graph and neighbor-sampled propagation.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.neighbor_sampling [n_entity ...]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+
+from time import time
+
+import tensorflow as tf
+
+from benchmark.common import build_model, parse_sizes, synthetic_dataset
+
+N_STEP = 20
+
+
+def time_steps(argv: list) -> float:
+    """Timing the average step of model.train_inter (excluding a warm-up step).
+    """
+    _, meta_data, data_generator, model = build_model(argv)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load_graph_data(sess, meta_data)
+
+        elapsed = 0.
+        for step in range(N_STEP + 1):
+            t1 = time()
+            batch_data = data_generator.generate_train_batch()
+            feed_dict = data_generator.generate_train_feed_dict(model, batch_data)
+            model.train_inter(sess, feed_dict)
+            if step > 0:
+                elapsed += time() - t1
+
+    return elapsed / N_STEP
+
+def main() -> None:
+    print('n_entity\tn_triple\tfull(s/step)\tneighbor(s/step)')
+    for n_entity in parse_sizes([10000, 100000, 1000000]):
+        n_triple = n_entity * 10
+        with synthetic_dataset('bench_neighbor_sampling', n_entity, n_triple) as dataset:
+            argv = ['--dataset', dataset, '--batch_size_gnn', '1024']
+            full = time_steps(argv + ['--sampling', 'full'])
+            neighbor = time_steps(argv + ['--sampling', 'neighbor', '--fanouts', '[10,10]'])
+        print('%d\t%d\t%.4f\t%.4f' % (n_entity, n_triple, full, neighbor))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmarking per-step training time and peak memory of dense and lazy (sparse) optimizers.
+
+Optimizers run with full-graph propagation (the default, whose gnn gradients are dense) and
+with neighbor sampling (whose gnn gradients are sparse, as kg gradients always are). Every
+configuration runs in its own process, so that peak resident memory is not shared.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.optimizer [n_entity ...]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+
+from time import time
+
+from benchmark.common import build_model, dispatch_run, parse_sizes, report_run, run_isolated, synthetic_dataset
+
+N_STEP = 20
+OPT_TYPES = ['Adam', 'LazyAdam', 'Adagrad']
+SAMPLINGS = ['full', 'neighbor']
+
+
+def time_steps(argv: list) -> tuple:
+    """Timing the average step of model.train_kg and model.train_inter (excluding a warm-up step).
+    """
+    import tensorflow as tf
+
+    _, meta_data, data_generator, model = build_model(argv)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load_graph_data(sess, meta_data)
+
+        kg_elapsed, inter_elapsed = 0., 0.
+        for step in range(N_STEP + 1):
+            t1 = time()
+            batch_data = data_generator.generate_train_kg_batch()
+            feed_dict = data_generator.generate_train_kg_feed_dict(model, batch_data)
+            model.train_kg(sess, feed_dict)
+            t2 = time()
+            batch_data = data_generator.generate_train_batch()
+            feed_dict = data_generator.generate_train_feed_dict(model, batch_data)
+            model.train_inter(sess, feed_dict)
+            if step > 0:
+                kg_elapsed += t2 - t1
+                inter_elapsed += time() - t2
+
+    return kg_elapsed / N_STEP, inter_elapsed / N_STEP
+
+def run(dataset: str, opt_type: str, sampling: str) -> None:
+    """Printing step times and peak resident memory (MB) of a single optimizer and sampling.
+    """
+    argv = ['--dataset', dataset, '--opt_type', opt_type, '--sampling', sampling,
+            '--batch_size_gnn', '1024', '--batch_size_kg', '1024']
+    report_run(*time_steps(argv))
+
+def main() -> None:
+    if dispatch_run(run):
+        return
+
+    print('n_entity\tsampling\topt_type\tkg(s/step)\tgnn(s/step)\tpeak(MB)')
+    for n_entity in parse_sizes([100000, 1000000]):
+        with synthetic_dataset('bench_optimizer', n_entity, n_entity * 10) as dataset:
+            for sampling in SAMPLINGS:
+                for opt_type in OPT_TYPES:
+                    output = run_isolated('benchmark.optimizer', dataset, opt_type, sampling)
+                    print('%d\t%s\t%s\t%s' % (n_entity, sampling, opt_type, output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Benchmarking peak memory and per-step time of gnn training with and without recomputation.
+
+Every configuration runs in its own process, so that peak resident memory is not shared.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.recompute [n_entity ...]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+
+from time import time
+
+from benchmark.common import build_model, dispatch_run, parse_sizes, report_run, run_isolated, synthetic_dataset
+
+N_STEP = 10
+LAYER_SIZE = '[64,64,64,64,64,64]'
+MESS_DROPOUT = '[0.1,0.1,0.1,0.1,0.1,0.1]'
+
+
+def time_steps(argv: list) -> float:
+    """Timing the average step of model.train_inter (excluding a warm-up step).
+    """
+    import tensorflow as tf
+
+    _, meta_data, data_generator, model = build_model(argv)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load_graph_data(sess, meta_data)
+
+        elapsed = 0.
+        for step in range(N_STEP + 1):
+            t1 = time()
+            batch_data = data_generator.generate_train_batch()
+            feed_dict = data_generator.generate_train_feed_dict(model, batch_data)
+            model.train_inter(sess, feed_dict)
+            if step > 0:
+                elapsed += time() - t1
+
+    return elapsed / N_STEP
+
+def run(dataset: str, agg_type: str, recompute: str) -> None:
+    """Printing step time and peak resident memory (MB) of a single configuration.
+    """
+    argv = ['--dataset', dataset, '--agg_type', agg_type, '--layer_size', LAYER_SIZE,
+            '--mess_dropout', MESS_DROPOUT, '--batch_size_gnn', '1024']
+    if recompute == 'on':
+        argv.append('--recompute')
+    report_run(time_steps(argv))
+
+def main() -> None:
+    if dispatch_run(run):
+        return
+
+    print('n_entity\tagg_type\trecompute\tgnn(s/step)\tpeak(MB)')
+    for n_entity in parse_sizes([100000, 1000000]):
+        with synthetic_dataset('bench_recompute', n_entity, n_entity * 10) as dataset:
+            for agg_type in ['graphsage', 'bi']:
+                for recompute in ['off', 'on']:
+                    output = run_isolated('benchmark.recompute', dataset, agg_type, recompute)
+                    print('%d\t%s\t%s\t%s' % (n_entity, agg_type, recompute, output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Checking the import time budget of recommend entry points with `python -X importtime`.
+
+Every entry point is imported in a fresh interpreter. The check fails (exit status 1) if an
+entry point imports a heavy module, which only the code paths using it should import, or if
+its cumulative import time exceeds the budget.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.startup [budget_ms]
+"""
+import subprocess
+import sys
+
+# heavy modules are imported once arguments are parsed (tensorflow) or by logging setup
+# (colorlog); scipy and sklearn are not needed anymore
+HEAVY_MODULES = ['tensorflow', 'scipy', 'sklearn', 'colorlog']
+ENTRY_POINTS = ['driver', 'util.setting', 'util.data_loader', 'util.model_eval', 'util.helper']
+DEFAULT_BUDGET_MS = 500
+
+# the child prints its imported modules and measures the import itself, for interpreters
+# without -X importtime (python 3.6)
+CHILD = '''
+import sys
+from time import time
+t1 = time()
+import {module}
+print(time() - t1)
+print(' '.join(sys.modules))
+'''
+
+
+def import_module(module: str) -> tuple:
+    """Importing module in a fresh interpreter, returning its import time (ms) and imported modules.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD.format(module=module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    elapsed, modules = output.stdout.decode().splitlines()[-2:]
+
+    # lines of -X importtime: "import time: self [us] | cumulative | imported package"
+    import_ms = float(elapsed) * 1000.
+    for line in output.stderr.decode().splitlines():
+        if line.startswith('import time:') and line.split('|')[-1].strip() == module:
+            import_ms = int(line.split('|')[1]) / 1000.
+
+    return import_ms, modules.split()
+
+def main() -> None:
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+
+    n_fail = 0
+    print('module\timport(ms)\theavy modules')
+    for module in ENTRY_POINTS:
+        import_ms, modules = import_module(module)
+        heavy = sorted(set(name.split('.')[0] for name in modules) & set(HEAVY_MODULES))
+        print('%s\t%.1f\t%s' % (module, import_ms, ','.join(heavy) or '-'))
+        if heavy or import_ms > budget_ms:
+            n_fail += 1
+
+    if n_fail > 0:
+        print('%d entry points exceed the startup budget (%.0f ms, no %s)' % (n_fail, budget_ms, ', '.join(HEAVY_MODULES)))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
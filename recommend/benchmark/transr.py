@@ -0,0 +1,91 @@
+"""Benchmarking TransR scoring with per-triple transform gathers and with relation buckets.
+
+Triples use the 27-relation vocabulary of encoding_parser.py. Every size times a training
+step (score and gradients) and a scoring pass over all triples in 50 folds, as in
+GNN.update_attentive_A.
+
+Run under ShadeWatcher/recommend:
+    python -m benchmark.transr [n_triple ...]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+
+from time import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmark.common import parse_sizes
+from model.GNN import GNN
+
+N_RELATION = 27
+N_ENTITY = 100000
+INTER_DIM, KG_DIM = 32, 32
+BATCH_SIZE = 2048
+N_STEP = 20
+N_FOLD = 50
+
+
+def gather_transform(e: tf.Tensor, r: tf.Tensor, trans_w: tf.Tensor) -> tf.Tensor:
+    """Projecting embeddings with a gathered transform per row (previous implementation).
+    """
+    trans_r = tf.nn.embedding_lookup(trans_w, r)
+    return tf.reshape(tf.matmul(tf.expand_dims(e, 1), trans_r), [-1, KG_DIM])
+
+def bucket_transform(e: tf.Tensor, r: tf.Tensor, trans_w: tf.Tensor) -> tf.Tensor:
+    """Projecting embeddings with one matmul per relation bucket.
+    """
+    return GNN._transform_by_relation(e, r, trans_w, N_RELATION)
+
+def time_transform(transform, triples: np.ndarray) -> tuple:
+    """Timing a training step and a folded scoring pass over triples, returning scores as well.
+    """
+    tf.reset_default_graph()
+    initializer = tf.contrib.layers.xavier_initializer(seed=2021)
+    embedding = tf.Variable(initializer([N_ENTITY, INTER_DIM]))
+    rel_embed = tf.Variable(initializer([N_RELATION, KG_DIM]))
+    trans_w = tf.Variable(initializer([N_RELATION, INTER_DIM, KG_DIM]))
+
+    h = tf.placeholder(tf.int64, shape=[None])
+    r = tf.placeholder(tf.int64, shape=[None])
+    t = tf.placeholder(tf.int64, shape=[None])
+    h_e = transform(tf.nn.embedding_lookup(embedding, h), r, trans_w)
+    t_e = transform(tf.nn.embedding_lookup(embedding, t), r, trans_w)
+    kg_score = tf.reduce_sum(tf.multiply(t_e, tf.tanh(h_e + tf.nn.embedding_lookup(rel_embed, r))), axis=1)
+    opt = tf.train.AdamOptimizer(learning_rate=0.001).minimize(tf.reduce_mean(kg_score))
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+
+        # score with the initial weights, which are identical for both implementations
+        t1 = time()
+        scores = [sess.run(kg_score, {h: fold[:, 0], r: fold[:, 1], t: fold[:, 2]})
+                  for fold in np.array_split(triples, N_FOLD)]
+        score_elapsed = time() - t1
+
+        train_elapsed = 0.
+        for step in range(N_STEP + 1):
+            batch = triples[np.random.randint(len(triples), size=BATCH_SIZE)]
+            t1 = time()
+            sess.run(opt, {h: batch[:, 0], r: batch[:, 1], t: batch[:, 2]})
+            if step > 0:
+                train_elapsed += time() - t1
+
+    return train_elapsed / N_STEP, score_elapsed, np.concatenate(scores)
+
+def main() -> None:
+    rng = np.random.RandomState(2021)
+
+    print('n_triple\tgather_train(s/step)\tbucket_train(s/step)\tgather_score(s)\tbucket_score(s)')
+    for n_triple in parse_sizes([100000, 1000000, 10000000]):
+        triples = np.stack((rng.randint(N_ENTITY, size=n_triple), rng.randint(N_RELATION, size=n_triple),
+                            rng.randint(N_ENTITY, size=n_triple)), axis=1)
+        gather_train, gather_score, gather_scores = time_transform(gather_transform, triples)
+        bucket_train, bucket_score, bucket_scores = time_transform(bucket_transform, triples)
+
+        # scores only differ by floating point reordering
+        assert np.allclose(gather_scores, bucket_scores, atol=1e-4)
+        print('%d\t%.4f\t%.4f\t%.2f\t%.2f' % (n_triple, gather_train, bucket_train, gather_score, bucket_score))
+
+if __name__ == '__main__':
+    main()
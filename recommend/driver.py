@@ -7,16 +7,11 @@ warnings.filterwarnings('ignore', category=RuntimeWarning)
 
 import random as rd
 import numpy as np
-import tensorflow as tf
 
 from time import time
 from util.setting import init_setting, logger
 from util.meta_data import MetaData
-
-from model.GNN import GNN
-from util.model_eval import early_stopping, test, validation
-from util.helper import ensureDir
-from util.data_loader import load_pretrain_embedding, load_data_engine
+from util.helper import ensureDir, get_weight_path
 
 
 def main() -> None:
@@ -25,21 +20,58 @@ def main() -> None:
     Control the workflow of modeling training and predicting.
     """
 
-    # set seed for random data
-    tf.set_random_seed(2021)
-    np.random.seed(2021)
-    rd.seed(2021)
-
     # init setting (user input and logging configuration)
     args = init_setting()
 
     # define GPU/CPU device to train model
     os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu_id
 
+    # tensorflow and the model are imported once arguments are parsed (see benchmark/startup.py)
+    import tensorflow as tf
+
+    # set seed for random data
+    tf.set_random_seed(args.seed)
+    np.random.seed(args.seed)
+    rd.seed(args.seed)
+
+    # score many datasets with a trained model restored once
+    if args.datasets:
+        from util.scoring import score_datasets
+        score_datasets(args)
+        return
+
+    # keep a trained model resident and score datasets on request
+    if args.serve:
+        from util.server import serve
+        serve(args)
+        return
+
+    # inference only scores with a (pre-trained) model
+    if args.inference and args.epoch > 0:
+        logger.error('inference does not build training operations, use --epoch 0')
+        exit(-1)
+
+    from model.GNN import GNN
+    from util.model_eval import early_stopping, test, validation
+    from util.data_loader import load_pretrain_embedding, load_data_engine
+
     # Load Dataset
-    meta_data = MetaData(args.dataset)
+    meta_data = MetaData(args.dataset, in_path=args.dataset_path, out_path=args.model_path)
     data_generator = load_data_engine(args, meta_data)
 
+    # prefetch training batches in background processes (forked before tensorflow sessions start),
+    # only for the training phases sampling batches outside the graph
+    prefetchers = []
+    generate_train_batch = data_generator.generate_train_batch
+    generate_train_kg_batch = data_generator.generate_train_kg_batch
+    if args.n_workers > 0 and args.epoch > 0 and not args.in_graph_sampling:
+        if args.no_gnn == False:
+            prefetchers.append(data_generator.prefetch_train_batches(args.n_workers))
+            generate_train_batch = prefetchers[-1].__next__
+        if args.no_kg == False:
+            prefetchers.append(data_generator.prefetch_train_kg_batches(args.n_workers))
+            generate_train_kg_batch = prefetchers[-1].__next__
+
     # Load pre-trained kg embeddings
     pretrain_embedding = None
     if args.pretrain == 1:
@@ -57,12 +89,7 @@ def main() -> None:
 
     # Save model parameter (weights)
     if args.save_model:
-        weight_save_path = None
-        save_saver = None
-        layer = '-'.join([str(l) for l in eval(args.layer_size)])
-        regs = '-'.join([str(r) for r in eval(args.regs)])
-        weight_save_path = '%s/%s/%s/weight/%s/_l%s/_r%s/model.weights' % \
-                            (meta_data.out_path, args.model_type, args.embedding_type, args.lr, layer, regs)
+        weight_save_path = get_weight_path(meta_data.out_path, args)
         ensureDir(weight_save_path)
         save_saver = tf.train.Saver(max_to_keep=1)
 
@@ -71,14 +98,14 @@ def main() -> None:
     tf_config.gpu_options.allow_growth = True
     sess = tf.Session(config=tf_config)
     sess.run(tf.global_variables_initializer())
+    model.load_graph_data(sess, meta_data)
+    if model.pipeline is not None:
+        model.pipeline.initialize(sess, data_generator)
     
     # Reload model parameters
     if args.pretrain == 2:
         saver = tf.train.Saver()
-        layer = '-'.join([str(l) for l in eval(args.layer_size)])
-        regs = '-'.join([str(r) for r in eval(args.regs)])
-        checkpoint_path = '%s/%s/%s/weight/%s/_l%s/_r%s/checkpoint' % \
-                        (meta_data.out_path, args.model_type, args.embedding_type, args.lr, layer, regs)
+        checkpoint_path = get_weight_path(meta_data.out_path, args)
         ckpt = tf.train.get_checkpoint_state(os.path.dirname(checkpoint_path))
         if ckpt and ckpt.all_model_checkpoint_paths:
             saver.restore(sess, ckpt.all_model_checkpoint_paths[0])
@@ -113,28 +140,47 @@ def main() -> None:
     stopping_step = 0
     best_tn = 0
 
-    # whether use knowledge-aware attention
-    if args.no_att == False:
-        model.update_attentive_A(sess)
+    # whether use knowledge-aware attention (read by training and testing)
+    if args.no_att == False and (args.epoch > 0 or args.show_test):
+        model.update_attentive_A(sess, data_generator.generate_attention_partitions())
 
     for epoch in range(args.epoch):
         t1 = time()
+        # refresh knowledge-aware attention during training
+        if args.no_att == False and args.att_refresh_every > 0 and epoch > 0 and epoch % args.att_refresh_every == 0:
+            model.update_attentive_A(sess, data_generator.generate_attention_partitions())
+
         # inter_loss is gnn/... loss, reg_loss is regularization loss
         loss, inter_loss, kg_loss, reg_loss = 0., 0., 0., 0.
 
         # phase 1: train the GNN
         if args.no_gnn == False:
             n_batch_gnn = data_generator.n_train_inter // args.batch_size_gnn + 1
-            for _ in range(n_batch_gnn):
-                # tt1 = time()
-                batch_data = data_generator.generate_train_batch()
-                feed_dict = data_generator.generate_train_feed_dict(model, batch_data)
-                # GNN: batch_loss = batch_inter_loss + batch_reg_loss
-                _, batch_loss, batch_inter_loss, batch_reg_loss = model.train_inter(sess, feed_dict)
-
-                loss += batch_loss
-                inter_loss += batch_inter_loss
-                reg_loss += batch_reg_loss
+            if args.steps_per_run > 1:
+                # run steps_per_run batches per session call
+                for i_batch in range(0, n_batch_gnn, args.steps_per_run):
+                    n_step = min(args.steps_per_run, n_batch_gnn - i_batch)
+                    batch_list = [generate_train_batch() for _ in range(n_step)]
+                    feed_dict = data_generator.generate_train_steps_feed_dict(model, batch_list)
+                    batch_loss, batch_inter_loss, batch_reg_loss = model.train_inter_steps(sess, feed_dict)
+
+                    loss += batch_loss
+                    inter_loss += batch_inter_loss
+                    reg_loss += batch_reg_loss
+            else:
+                for _ in range(n_batch_gnn):
+                    # tt1 = time()
+                    if args.in_graph_sampling:
+                        feed_dict = data_generator.generate_pipeline_feed_dict(model)
+                    else:
+                        batch_data = generate_train_batch()
+                        feed_dict = data_generator.generate_train_feed_dict(model, batch_data)
+                    # GNN: batch_loss = batch_inter_loss + batch_reg_loss
+                    _, batch_loss, batch_inter_loss, batch_reg_loss = model.train_inter(sess, feed_dict)
+
+                    loss += batch_loss
+                    inter_loss += batch_inter_loss
+                    reg_loss += batch_reg_loss
 
             if np.isnan(loss) == True:
                 logger.error('error: loss@gnn is nan')
@@ -143,15 +189,31 @@ def main() -> None:
         # phase 2: train the KG embedding (e.g., TransR)
         if args.no_kg == False:
             n_batch_kg = len(data_generator.all_h_list) // args.batch_size_kg + 1 
-            for _ in range(n_batch_kg):
-                batch_data = data_generator.generate_train_kg_batch()
-                feed_dict = data_generator.generate_train_kg_feed_dict(model, batch_data)
-                # TransR: batch_loss = batch_kg_loss + batch_reg_loss
-                _, batch_loss, batch_kg_loss, batch_reg_loss = model.train_kg(sess, feed_dict)
-
-                loss += batch_loss
-                kg_loss += batch_kg_loss
-                reg_loss += batch_reg_loss
+            if args.steps_per_run > 1:
+                # run steps_per_run batches per session call
+                for i_batch in range(0, n_batch_kg, args.steps_per_run):
+                    n_step = min(args.steps_per_run, n_batch_kg - i_batch)
+                    batch_list = [generate_train_kg_batch() for _ in range(n_step)]
+                    feed_dict = data_generator.generate_train_kg_steps_feed_dict(model, batch_list)
+                    batch_loss, batch_kg_loss, batch_reg_loss = model.train_kg_steps(sess, feed_dict)
+
+                    loss += batch_loss
+                    kg_loss += batch_kg_loss
+                    reg_loss += batch_reg_loss
+            else:
+                for _ in range(n_batch_kg):
+                    if args.in_graph_sampling:
+                        # kg batches are sampled in graph
+                        feed_dict = {}
+                    else:
+                        batch_data = generate_train_kg_batch()
+                        feed_dict = data_generator.generate_train_kg_feed_dict(model, batch_data)
+                    # TransR: batch_loss = batch_kg_loss + batch_reg_loss
+                    _, batch_loss, batch_kg_loss, batch_reg_loss = model.train_kg(sess, feed_dict)
+
+                    loss += batch_loss
+                    kg_loss += batch_kg_loss
+                    reg_loss += batch_reg_loss
 
             if np.isnan(loss) == True:
                 logger.error('error: loss@kg embedding is nan')
@@ -185,6 +247,9 @@ def main() -> None:
                 if should_stop:
                     break
 
+    for prefetcher in prefetchers:
+        prefetcher.close()
+
     # Testing Phase
     if args.show_test:
         rel_stat = test(sess, model, data_generator, args.threshold)
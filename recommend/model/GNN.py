@@ -4,7 +4,6 @@ warnings.filterwarnings('ignore', category=FutureWarning)
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
 import numpy as np
-import scipy.sparse as sp
 import tensorflow as tf
 from util.meta_data import MetaData
 import argparse
@@ -22,6 +21,12 @@ class GNN(object):
         logger.info("start initing Graph Neural Network...")
         self._parse_args(args, meta_data, pretrain_embedding)
 
+        # sample training batches in graph instead of feeding them
+        self.pipeline = None
+        if args.in_graph_sampling and not self.inference:
+            from util.tf_pipeline import TrainPipeline
+            self.pipeline = TrainPipeline(args, meta_data)
+
         # create placeholder for training inputs
         self._build_inputs()
 
@@ -35,6 +40,14 @@ class GNN(object):
         # compute Graph-based Representation via Graph Neural Network
         self._build_inter_model()
 
+        # inference only propagates and scores: no losses, optimizers or kg inference, and
+        # kg scoring only for knowledge-aware attention
+        if self.inference:
+            if self.use_att:
+                self._build_attention_model(args.embedding_type)
+            self._statistics_params()
+            return
+
         # optimize Recommendation (gnn) via BPR loss
         self._build_inter_loss()
 
@@ -49,6 +62,10 @@ class GNN(object):
         # optimize TransR via BPR loss
         self._build_kg_loss()
 
+        # run several optimizer steps per session run
+        if self.steps_per_run > 1:
+            self._build_multi_step_train()
+
         # count #parameters (weights)
         self._statistics_params()
 
@@ -66,14 +83,6 @@ class GNN(object):
         self.n_relation = meta_data.n_relation
         self.n_entity_attr = meta_data.n_entity_attr
 
-        # Todo: Set up n_fold for training; may not need n_fold
-        self.n_fold = 1
-        if self.n_entity_attr < self.n_fold:
-            self.n_fold = 1
-
-        # init attentive matrix A for phase I
-        self.A_in = meta_data.A_in
-
         # knowledge graph triplets
         self.all_h_list = meta_data.all_h_list
         self.all_r_list = meta_data.all_r_list
@@ -86,9 +95,28 @@ class GNN(object):
         self.weight_size = eval(args.layer_size)
         self.n_layer = len(self.weight_size)
         self.agg_type = args.agg_type
+        self.sampling = args.sampling
+        self.recompute = args.recompute
+        self.steps_per_run = args.steps_per_run
+        self.inference = args.inference
+        self.use_att = not args.no_att
+        if self.steps_per_run > 1 and self.sampling != 'full':
+            logger.error('multiple steps per run only support full-graph propagation')
+            exit(-1)
+        if args.in_graph_sampling and self.sampling != 'full':
+            logger.error('in-graph sampling only supports full-graph propagation')
+            exit(-1)
+        if args.in_graph_sampling and self.steps_per_run > 1:
+            logger.error('in-graph sampling does not support multiple steps per run')
+            exit(-1)
+
+        # number of row folds of A in full-graph propagation (never built with cluster sampling)
+        self.n_fold = self._get_n_fold(args.n_fold, args.propagation_memory_mb) if self.sampling != 'cluster' else 1
 
         # setting for kg
         self.kg_dim = args.kg_dim
+        # number of triples scored at once by the attention refresh
+        self.att_fold_size = self._get_att_fold_size(args.att_memory_mb)
         self.batch_size_kg = args.batch_size_kg
         self.margin = 1.0
 
@@ -101,29 +129,107 @@ class GNN(object):
 
         self.model_type += '_%s_%s_l%d' % (args.adj_type, self.agg_type, self.n_layer)
 
+    def _get_n_fold(self, n_fold: int, memory_mb: int) -> int:
+        """Choosing number of row folds of A, so that propagating a fold fits in memory_mb.
+
+        Per layer, a fold costs its sparse entries (int64 indices, float32 values), the
+        gathered neighbor embeddings of every entry, and the dense output rows:
+            nnz * (20 + 4 * dim) + rows * 4 * dim bytes
+        """
+        if n_fold <= 0:
+            n_fold = 1
+            if memory_mb > 0:
+                nnz, n_row = len(self.all_h_list), self.n_entity_attr
+                dim = max([self.inter_dim] + self.weight_size)
+                cost = nnz * (20 + 4 * dim) + n_row * 4 * dim
+                n_fold = int(np.ceil(cost / (memory_mb * 1024. * 1024.)))
+                logger.info('propagation of A (nnz: {}, rows: {}) is split into {} folds'.format(nnz, n_row, n_fold))
+
+        return max(1, min(n_fold, self.n_entity_attr))
+
     def _build_inputs(self):
         """Building inputs for interaction, kg, dropout, and attention
         """
         logger.info('start building inputs')
-        # inputs for interactions
-        self.e = tf.placeholder(tf.int64, shape=[None], name='e')
-        self.pos_e = tf.placeholder(tf.int64, shape=[None], name='pos_e')
-        self.neg_e = tf.placeholder(tf.int64, shape=[None], name='neg_e')
-
-        # inputs for kg
-        self.h = tf.placeholder(tf.int64, shape=[None], name='h')
-        self.r = tf.placeholder(tf.int64, shape=[None], name='r')
-        self.pos_t = tf.placeholder(tf.int64, shape=[None], name='pos_t')
-        self.neg_t = tf.placeholder(tf.int64, shape=[None], name='neg_t')
+        if self.pipeline is None:
+            # inputs for interactions
+            self.e = tf.placeholder(tf.int64, shape=[None], name='e')
+            self.pos_e = tf.placeholder(tf.int64, shape=[None], name='pos_e')
+            self.neg_e = tf.placeholder(tf.int64, shape=[None], name='neg_e')
+
+            # inputs for kg
+            self.h = tf.placeholder(tf.int64, shape=[None], name='h')
+            self.r = tf.placeholder(tf.int64, shape=[None], name='r')
+            self.pos_t = tf.placeholder(tf.int64, shape=[None], name='pos_t')
+            self.neg_t = tf.placeholder(tf.int64, shape=[None], name='neg_t')
+        else:
+            # inputs default to in-graph sampled batches unless fed (e.g., in evaluation)
+            e, pos_e, neg_e = self.pipeline.inter_batch
+            self.e = tf.placeholder_with_default(e, shape=[None], name='e')
+            self.pos_e = tf.placeholder_with_default(pos_e, shape=[None], name='pos_e')
+            self.neg_e = tf.placeholder_with_default(neg_e, shape=[None], name='neg_e')
+
+            h, r, pos_t, neg_t = self.pipeline.kg_batch
+            self.h = tf.placeholder_with_default(h, shape=[None], name='h')
+            self.r = tf.placeholder_with_default(r, shape=[None], name='r')
+            self.pos_t = tf.placeholder_with_default(pos_t, shape=[None], name='pos_t')
+            self.neg_t = tf.placeholder_with_default(neg_t, shape=[None], name='neg_t')
 
         # dropout: message dropout (adopted on the convolution operations)
         # Todo: add node dropout
         self.mess_dropout = tf.placeholder(tf.float32, shape=[None], name='mess_dropout')
 
-        # Inputs for attention-aware knowledge update
-        self.A_values = tf.placeholder(tf.float32, shape=[len(self.all_v_list)], name='A_values')
+        # graph data (kg triples) is fed into local variables by load_graph_data instead of
+        # being embedded as constants, so that the GraphDef does not depend on the graph size
+        self.A_indices_init = tf.placeholder(tf.int64, shape=[None, 2], name='A_indices_init')
+        self.A_att_init = tf.placeholder(tf.float32, shape=[None], name='A_att_init')
+        self.A_relations_init = tf.placeholder(tf.int64, shape=[None], name='A_relations_init')
+        self.A_fold_rows_init = tf.placeholder(tf.int64, shape=[self.n_fold + 1], name='A_fold_rows_init')
+        self.A_fold_offsets_init = tf.placeholder(tf.int64, shape=[self.n_fold + 1], name='A_fold_offsets_init')
+
+        # (head, tail) indices of kg triples sorted by head
+        self.A_indices = self._create_local_variable(self.A_indices_init, 'A_indices')
+        # attention values of kg triples (indices are fixed), propagation reads them and
+        # update_attentive_A assigns them in place; local variables are excluded from checkpoints
+        self.A_att = self._create_local_variable(self.A_att_init, 'A_att')
+        # relations of kg triples, scored by the attention refresh
+        self.A_relations = self._create_local_variable(self.A_relations_init, 'A_relations')
+        # first row and first triple of every fold of A
+        self.A_fold_rows = self._create_local_variable(self.A_fold_rows_init, 'A_fold_rows')
+        self.A_fold_offsets = self._create_local_variable(self.A_fold_offsets_init, 'A_fold_offsets')
+        # (row, col) indices normalized by the attention refresh, fed with merged local ids by
+        # batched evaluation graphs, so that heads of different graphs never share a row
+        self.A_rows = tf.placeholder_with_default(self.A_indices, shape=[None, 2], name='A_rows')
+        # inputs for subgraphs (sampled batches, clusters or batched evaluation graphs): global node
+        # ids, local (row, col) indices of edges, triple ids and estimator scales of edges (or edge
+        # values fed directly), and local ids of the batch
+        self.sub_nodes = tf.placeholder(tf.int64, shape=[None], name='sub_nodes')
+        self.sub_indices = tf.placeholder(tf.int64, shape=[None, 2], name='sub_indices')
+        self.sub_edges = tf.placeholder(tf.int64, shape=[None], name='sub_edges')
+        self.sub_scale = tf.placeholder(tf.float32, shape=[None], name='sub_scale')
+        self.sub_values = tf.placeholder_with_default(tf.gather(self.A_att, self.sub_edges) * self.sub_scale,
+                                                      shape=[None], name='sub_values')
+        self.sub_e = tf.placeholder(tf.int64, shape=[None], name='sub_e')
+        self.sub_pos_e = tf.placeholder(tf.int64, shape=[None], name='sub_pos_e')
+        self.sub_neg_e = tf.placeholder(tf.int64, shape=[None], name='sub_neg_e')
+        # inputs for multiple steps per run: batches of every step are stacked by rows
+        if self.steps_per_run > 1:
+            self.e_steps = tf.placeholder(tf.int64, shape=[None, None], name='e_steps')
+            self.pos_e_steps = tf.placeholder(tf.int64, shape=[None, None], name='pos_e_steps')
+            self.neg_e_steps = tf.placeholder(tf.int64, shape=[None, None], name='neg_e_steps')
+            self.h_steps = tf.placeholder(tf.int64, shape=[None, None], name='h_steps')
+            self.r_steps = tf.placeholder(tf.int64, shape=[None, None], name='r_steps')
+            self.pos_t_steps = tf.placeholder(tf.int64, shape=[None, None], name='pos_t_steps')
+            self.neg_t_steps = tf.placeholder(tf.int64, shape=[None, None], name='neg_t_steps')
         logger.info('finish building inputs')
 
+    @staticmethod
+    def _create_local_variable(init: tf.Tensor, name: str) -> tf.Variable:
+        """Creating non-trainable local variable initialized by feeding init placeholder.
+        """
+        return tf.Variable(init, trainable=False, validate_shape=False, name=name,
+                           collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
     def _build_weights(self, embedding_type: str) -> None:
         """Building weights placeholder for model parameters.
         """
@@ -140,17 +246,19 @@ class GNN(object):
             all_weight['entity_attr_embed'] = tf.Variable(initial_value=self.pretrain_embedding['entity_attr_embed'], trainable=True, name='entity_attr_embed', dtype=tf.float32)
             logger.info('adapting Pre-train results to initialize kg embedding')
 
-        logger.info('adapting Xavier to initialize relation embedding')
-        all_weight['rel_embed'] = tf.Variable(initializer([self.n_relation, self.kg_dim]), name='rel_embed')
-        
-        # transformation matrix for TransR
-        logger.info('adapting Xavier to initialize TransR embedding')
-        all_weight['trans_w'] = tf.Variable(initializer([self.n_relation, self.inter_dim, self.kg_dim]), name='trans_w')
-        
-        # hyperplane matrix for TransH
-        if embedding_type == 'transh':
-            logger.info('adapting Xavier to initialize transH embedding')
-            all_weight['trans_h'] = tf.Variable(initializer([self.n_relation, self.kg_dim]), name='trans_h')
+        # kg embedding weights are only read by kg inference and attention
+        if not self.inference or self.use_att:
+            logger.info('adapting Xavier to initialize relation embedding')
+            all_weight['rel_embed'] = tf.Variable(initializer([self.n_relation, self.kg_dim]), name='rel_embed')
+
+            # transformation matrix for TransR
+            logger.info('adapting Xavier to initialize TransR embedding')
+            all_weight['trans_w'] = tf.Variable(initializer([self.n_relation, self.inter_dim, self.kg_dim]), name='trans_w')
+
+            # hyperplane matrix for TransH
+            if embedding_type == 'transh':
+                logger.info('adapting Xavier to initialize transH embedding')
+                all_weight['trans_h'] = tf.Variable(initializer([self.n_relation, self.kg_dim]), name='trans_h')
 
         weight_size_list = [self.inter_dim] + self.weight_size
 
@@ -191,58 +299,65 @@ class GNN(object):
         """
         logger.info('start building inter model')
         if self.agg_type in ['bi']:
-            self.ea_embedding = self._create_bi_inter_embed()
+            create_embed = self._create_bi_inter_embed
         elif self.agg_type in ['gcn']:
-            self.ea_embedding = self._create_gcn_embed()
+            create_embed = self._create_gcn_embed
         elif self.agg_type in ['graphsage']:
-            self.ea_embedding = self._create_graphsage_embed()
+            create_embed = self._create_graphsage_embed
         else:
             logger.error('graph aggregator type is unknown')
             exit(-1)
-        
-        # lookup embeddings for entity and its positive and negative interactions
-        self.e_e = tf.nn.embedding_lookup(self.ea_embedding, self.e)
-        self.pos_e_e = tf.nn.embedding_lookup(self.ea_embedding, self.pos_e)
-        self.neg_e_e = tf.nn.embedding_lookup(self.ea_embedding, self.neg_e)
 
-        # prediction
-        self.batch_predictions = tf.matmul(self.e_e, self.neg_e_e, transpose_a=False, transpose_b=True)
-        
+        self.create_embed = create_embed
+
+        # full-graph propagation over all nodes (cluster sampling only propagates partitions,
+        # so that graph data variables and activations never cover the whole graph)
+        if self.sampling != 'cluster':
+            self.ea_embedding = create_embed(self._split_A_hat(), self.weights['entity_attr_embed'])
+
+            # lookup embeddings for entity and its positive and negative interactions
+            self.e_e = tf.nn.embedding_lookup(self.ea_embedding, self.e)
+            self.pos_e_e = tf.nn.embedding_lookup(self.ea_embedding, self.pos_e)
+            self.neg_e_e = tf.nn.embedding_lookup(self.ea_embedding, self.neg_e)
+
+            # prediction: elementwise score of every (e, neg_e) pair
+            self.batch_predictions = tf.reduce_sum(tf.multiply(self.e_e, self.neg_e_e), axis=1, name='batch_predictions')
+
+        # propagation only over the nodes of a subgraph
+        n_sub = tf.shape(self.sub_nodes, out_type=tf.int64)[0]
+        sub_A = tf.SparseTensor(self.sub_indices, self.sub_values, tf.stack([n_sub, n_sub]))
+        sub_embedding = tf.nn.embedding_lookup(self.weights['entity_attr_embed'], self.sub_nodes)
+        self.sub_ea_embedding = create_embed([sub_A], sub_embedding)
+
+        if self.sampling == 'full':
+            self.train_e_e, self.train_pos_e_e, self.train_neg_e_e = self.e_e, self.pos_e_e, self.neg_e_e
+        else:
+            # sampled propagation over a per-batch subgraph
+            self.train_e_e = tf.nn.embedding_lookup(self.sub_ea_embedding, self.sub_e)
+            self.train_pos_e_e = tf.nn.embedding_lookup(self.sub_ea_embedding, self.sub_pos_e)
+            self.train_neg_e_e = tf.nn.embedding_lookup(self.sub_ea_embedding, self.sub_neg_e)
+
         logger.info('finish building inter model')
 
-    def _create_gcn_embed(self) -> tf.Tensor:
+    def _create_gcn_embed(self, A_fold_hat: list, pre_embedding: tf.Tensor) -> tf.Tensor:
         """Creating GCN network
+
+        A_fold_hat is a set of adjacency sub-matrix (split by rows) from attention matrix for
+        Knowledge-aware Attention, pre_embedding is the previous embedding (before update).
         """
-        logger.info('start building GCN network')
-        # attention matrix for Knowledge-aware Attention
-        A = self.A_in
+        def _aggregate(A_fold_hat, pre_embedding, w, b):
+            # sum embeddings of neighbors
+            neighbor_embedding = self._sum_neighbors(A_fold_hat, pre_embedding)
 
-        # generate a set of adjacency sub-matrix.
-        A_fold_hat = self._split_A_hat(A)
+            # LeakyReLU (W1(eh + eNh))
+            return tf.nn.leaky_relu(tf.matmul(neighbor_embedding + pre_embedding, w) + b)
 
-        # previous embedding (before update)
-        pre_embedding = self.weights['entity_attr_embed']
+        logger.info('start building GCN network')
         ea_embeddings = [pre_embedding]
 
         for k in range(self.n_layer):
-            # sum embeddings of neighbors
-            temp_embed = []
-            if self.n_fold == 1:
-                neighbor_embedding = tf.sparse_tensor_dense_matmul(A_fold_hat[0], pre_embedding, name='gcn_neighbor_{}'.format(k))
-            else:
-                for f in range(self.n_fold):
-                    temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], pre_embedding))
-                neighbor_embedding = tf.concat(temp_embed, 0, name='gcn_neighbor_{}'.format(k))
-
-            # LeakyReLU (W1(eh + eNh))
-            pre_embedding = neighbor_embedding + pre_embedding
-            pre_embedding = tf.nn.leaky_relu(
-                tf.matmul(pre_embedding, self.weights['w_gcn_%d' % k]) + self.weights['b_gcn_%d' % k], name='gcn_embed_{}'.format(k))
-
-            # dropout for overfitting mitigation
-            pre_embedding = tf.nn.dropout(pre_embedding, 1 - self.mess_dropout[k], name='gcn_dropout_{}'.format(k))
-            # normalize the distribution of embedding
-            norm_embeddings = tf.math.l2_normalize(pre_embedding, axis=1, name='gcn_norm_{}'.format(k))
+            pre_embedding, norm_embeddings = self._propagate_layer(
+                k, _aggregate, A_fold_hat, pre_embedding, [self.weights['w_gcn_%d' % k], self.weights['b_gcn_%d' % k]])
 
             ea_embeddings += [norm_embeddings]
 
@@ -252,41 +367,28 @@ class GNN(object):
 
         return ea_embeddings
 
-    def _create_graphsage_embed(self) -> tf.Tensor:
+    def _create_graphsage_embed(self, A_fold_hat: list, pre_embedding: tf.Tensor) -> tf.Tensor:
         """Creating GraphSage network
-        """
-        logger.info('start building GraphSage network')
-        # attention matrix for Knowledge-aware Attention
-        A = self.A_in
 
-        # generate a set of adjacency sub-matrix.
-        A_fold_hat = self._split_A_hat(A)
-
-        # previous embedding (before update) 
-        pre_embedding = self.weights['entity_attr_embed']
-        ea_embeddings = [pre_embedding]
-
-        for k in range(self.n_layer):
+        A_fold_hat is a set of adjacency sub-matrix (split by rows) from attention matrix for
+        Knowledge-aware Attention, pre_embedding is the previous embedding (before update).
+        """
+        def _aggregate(A_fold_hat, pre_embedding, w, b):
             # line 1 in algorithm 1 [RM-GCN, KDD'2018], aggregator layer: weighted sum
-            temp_embed = []
-            if self.n_fold == 1:
-                neighbor_embedding = tf.sparse_tensor_dense_matmul(A_fold_hat[0], pre_embedding, name='sage_neighbor_{}'.format(k))
-            else:
-                for f in range(self.n_fold):
-                    temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], pre_embedding))
-                neighbor_embedding = tf.concat(temp_embed, 0, name='sage_neighbor_{}'.format(k))
+            neighbor_embedding = self._sum_neighbors(A_fold_hat, pre_embedding)
 
             # line 2 in algorithm 1 [RM-GCN, KDD'2018], aggregating the previous embedding
             neighbor_embedding = tf.concat([pre_embedding, neighbor_embedding], 1)
 
             # LeakyReLU (W1(eh || eNh))
-            pre_embedding = tf.nn.leaky_relu(
-                tf.matmul(neighbor_embedding, self.weights['w_sage_%d' % k]) + self.weights['b_sage_%d' % k])
+            return tf.nn.leaky_relu(tf.matmul(neighbor_embedding, w) + b)
 
-            pre_embedding = tf.nn.dropout(pre_embedding, 1 - self.mess_dropout[k])
+        logger.info('start building GraphSage network')
+        ea_embeddings = [pre_embedding]
 
-            # normalize the distribution of embeddings.
-            norm_embeddings = tf.math.l2_normalize(pre_embedding, axis=1)
+        for k in range(self.n_layer):
+            pre_embedding, norm_embeddings = self._propagate_layer(
+                k, _aggregate, A_fold_hat, pre_embedding, [self.weights['w_sage_%d' % k], self.weights['b_sage_%d' % k]])
 
             ea_embeddings += [norm_embeddings]
 
@@ -295,49 +397,31 @@ class GNN(object):
 
         return ea_embeddings
 
-    def _create_bi_inter_embed(self) -> tf.Tensor:
+    def _create_bi_inter_embed(self, A_fold_hat: list, pre_embedding: tf.Tensor) -> tf.Tensor:
         """Creating bi-inter network
-        """
-        logger.info('start building Bi-Inter network')
-        # attention matrix for Knowledge-aware Attention
-        A = self.A_in
-
-        # generate a set of adjacency sub-matrix for memory efficiency (hat => head attention)
-        A_fold_hat = self._split_A_hat(A)
 
-        # previous embedding (before update)
-        pre_embedding = self.weights['entity_attr_embed']
-        ea_embeddings = [pre_embedding]
-
-        for k in range(self.n_layer):
+        A_fold_hat is a set of adjacency sub-matrix (split by rows) from attention matrix for
+        Knowledge-aware Attention, pre_embedding is the previous embedding (before update).
+        """
+        def _aggregate(A_fold_hat, pre_embedding, w, b):
             # sum embeddings of neighbors
-            temp_embed = []
-            if self.n_fold == 1:
-                neighbor_embedding = tf.sparse_tensor_dense_matmul(A_fold_hat[0], pre_embedding, name='bi_neighbor_{}'.format(k))
-            else:
-                for f in range(self.n_fold):
-                    temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], pre_embedding))
-                neighbor_embedding = tf.concat(temp_embed, 0, name='bi_neighbor_{}'.format(k))
-
+            neighbor_embedding = self._sum_neighbors(A_fold_hat, pre_embedding)
 
             # LeakyReLU (W1(eh + eNh))
-            add_embedding = neighbor_embedding + pre_embedding
-            sum_embedding = tf.nn.leaky_relu(
-                tf.matmul(add_embedding, self.weights['w_bi_%d'%k])+self.weights['b_bi_%d'%k]
-            )
-            
+            sum_embedding = tf.nn.leaky_relu(tf.matmul(neighbor_embedding + pre_embedding, w) + b)
+
             # LeakyReLU (W2(eh ⊙ eNh))
-            dot_embedding = tf.multiply(neighbor_embedding, pre_embedding)
-            bi_embedding = tf.nn.leaky_relu(
-                tf.matmul(dot_embedding, self.weights['w_bi_%d'%k])+self.weights['b_bi_%d'%k]
-            )
+            bi_embedding = tf.nn.leaky_relu(tf.matmul(tf.multiply(neighbor_embedding, pre_embedding), w) + b)
 
-            pre_embedding = sum_embedding + bi_embedding
-            # dropout for overfitting mitigation
-            pre_embedding = tf.nn.dropout(pre_embedding, 1 - self.mess_dropout[k])
+            return sum_embedding + bi_embedding
+
+        logger.info('start building Bi-Inter network')
+        ea_embeddings = [pre_embedding]
+
+        for k in range(self.n_layer):
+            pre_embedding, norm_embedding = self._propagate_layer(
+                k, _aggregate, A_fold_hat, pre_embedding, [self.weights['w_bi_%d' % k], self.weights['b_bi_%d' % k]])
 
-            # normalize the distribution of embeddings
-            norm_embedding = tf.math.l2_normalize(pre_embedding, axis=1)
             ea_embeddings += [norm_embedding]
 
         ea_embeddings = tf.concat(ea_embeddings, 1)
@@ -346,106 +430,248 @@ class GNN(object):
 
         return ea_embeddings
 
+    @staticmethod
+    def _sum_neighbors(A_fold_hat: list, pre_embedding: tf.Tensor) -> tf.Tensor:
+        """Summing embeddings of neighbors with adjacency sub-matrices (split by rows).
+        """
+        if len(A_fold_hat) == 1:
+            return tf.sparse_tensor_dense_matmul(A_fold_hat[0], pre_embedding)
+
+        return tf.concat([tf.sparse_tensor_dense_matmul(A_fold, pre_embedding) for A_fold in A_fold_hat], 0)
+
+    def _propagate_layer(self, k: int, aggregate, A_fold_hat: list, pre_embedding: tf.Tensor, weights: list) -> tuple:
+        """Propagating layer k: aggregate(A_fold_hat, pre_embedding, *weights), message dropout and normalization.
+
+        Returns the layer embedding (input of the next layer) and its normalized embedding.
+        With recompute, activations inside the layer are not kept for backprop but recomputed
+        from the layer input in the backward pass; dropout masks are drawn from a per-step
+        seed, so that recomputation reproduces them.
+        """
+        if not self.recompute:
+            # dropout for overfitting mitigation
+            embedding = tf.nn.dropout(aggregate(A_fold_hat, pre_embedding, *weights), 1 - self.mess_dropout[k])
+            # normalize the distribution of embeddings
+            return embedding, tf.math.l2_normalize(embedding, axis=1)
+
+        # adjacency folds read graph data variables, which tf.custom_gradient would resolve as
+        # trainable variables of the layer, so that they enter it as (constant) tensor inputs
+        graph_inputs = sum(([A_fold.indices, A_fold.values, A_fold.dense_shape] for A_fold in A_fold_hat), [])
+        n_graph = len(graph_inputs)
+
+        def _layer(seed, *inputs):
+            A_fold_hat = [tf.SparseTensor(*inputs[i:i + 3]) for i in range(0, n_graph, 3)]
+            pre_embedding, weights = inputs[n_graph], inputs[n_graph + 1:]
+            embedding = self._stateless_dropout(aggregate(A_fold_hat, pre_embedding, *weights), self.mess_dropout[k], seed)
+            return embedding, tf.math.l2_normalize(embedding, axis=1)
+
+        seed = tf.random.uniform([2], maxval=tf.int64.max, dtype=tf.int64)
+        return self._recompute_grad(_layer, 1 + n_graph)(seed, *graph_inputs, pre_embedding, *weights)
+
+    @staticmethod
+    def _stateless_dropout(x: tf.Tensor, rate: tf.Tensor, seed: tf.Tensor) -> tf.Tensor:
+        """Dropping out x with rate, where the mask is a function of seed.
+        """
+        keep = tf.random.stateless_uniform(tf.shape(x), seed=seed) >= rate
+        return tf.where(keep, x / (1. - rate), tf.zeros_like(x))
+
+    @staticmethod
+    def _recompute_grad(fn, n_const: int = 0):
+        """Wrapping fn (of tensors) so that its activations are recomputed in the backward pass.
+
+        The first n_const inputs (e.g., seeds and adjacency) get no gradient.
+        """
+        @tf.custom_gradient
+        def _fn(*inputs):
+            outputs = fn(*inputs)
+
+            def _grad(*grad_outputs):
+                # gradients of embedding lookups arrive as IndexedSlices
+                grad_outputs = [tf.convert_to_tensor(grad) for grad in grad_outputs]
+                # recompute once output gradients exist, so that forward activations can be freed
+                with tf.control_dependencies(grad_outputs):
+                    recompute_inputs = [tf.identity(x) for x in inputs]
+                recompute_outputs = fn(*recompute_inputs)
+                return [None] * n_const + tf.gradients(recompute_outputs, recompute_inputs[n_const:], grad_ys=grad_outputs)
+
+            return outputs, _grad
+
+        return _fn
+
     def _build_inter_loss(self) -> None:
         """Building inter model loss function
         """
         logger.info('start building inter loss')
-        current_batch_size = tf.shape(self.e_e)[0]
-        neg_scores = tf.reduce_sum(tf.multiply(self.e_e, self.neg_e_e), axis=1, name='gnn_neg_scores')
+        self.inter_loss, self.reg_loss = self._get_inter_loss(self.train_e_e, self.train_pos_e_e, self.train_neg_e_e)
+        self.loss = self.inter_loss + self.reg_loss
+
+        # Optimization
+        logger.info('adapting {} as optimization function for gnn' .format(self.opt_type))
+        self.inter_optimizer = self._get_optimizer()
+        self.opt = self.inter_optimizer.minimize(self.loss)
+
+        logger.info('finish building inter loss')
+
+    def _get_inter_loss(self, e_e: tf.Tensor, pos_e_e: tf.Tensor, neg_e_e: tf.Tensor) -> tuple:
+        """Calculating BPR loss and regularization loss of a batch of interaction embeddings.
+        """
+        current_batch_size = tf.shape(e_e)[0]
+        neg_scores = tf.reduce_sum(tf.multiply(e_e, neg_e_e), axis=1, name='gnn_neg_scores')
 
         pos_scores = tf.zeros([current_batch_size], name='gnn_pos_scores')
         for i in range(self.inter_pos_rate):
             # generate positive sub batch to calculate pos_scores
-            _pos_e_e = self.pos_e_e[i::self.inter_pos_rate]
-            pos_scores += tf.reduce_sum(tf.multiply(self.e_e, _pos_e_e), axis=1)
+            _pos_e_e = pos_e_e[i::self.inter_pos_rate]
+            pos_scores += tf.reduce_sum(tf.multiply(e_e, _pos_e_e), axis=1)
 
         # regularization for overfitting mitigation
-        regularizer = tf.nn.l2_loss(self.e_e) + tf.nn.l2_loss(self.pos_e_e) + \
-                      tf.nn.l2_loss(self.neg_e_e)
+        regularizer = tf.nn.l2_loss(e_e) + tf.nn.l2_loss(pos_e_e) + tf.nn.l2_loss(neg_e_e)
         regularizer = regularizer / tf.cast(current_batch_size, dtype=tf.float32)
 
         # Using softplus to implement BPR loss
         # negatives are benign interactions; and positives are malicious interactions 
         inter_loss = tf.reduce_mean(tf.nn.softplus(neg_scores - pos_scores), name='gnn_loss')
 
-        self.inter_loss = inter_loss
-        self.reg_loss = self.regs[0] * regularizer
-        self.loss = self.inter_loss + self.reg_loss
+        return inter_loss, self.regs[0] * regularizer
 
-        # Optimization
-        logger.info('adapting {} as optimization function for gnn' .format(self.opt_type))
+    def _get_optimizer(self) -> tf.train.Optimizer:
+        """Creating the optimizer of opt_type.
+
+        LazyAdam and Adagrad only update optimizer slots of the embedding rows gathered in a
+        batch (sparse gradients), whereas Adam decays the moments of the entire embedding table.
+        Gradients are only sparse if embeddings are gathered: kg steps and sampled gnn steps,
+        but full-graph propagation (the default) multiplies the whole table, so that gnn steps
+        get dense gradients and every optimizer updates every row.
+        """
         if self.opt_type in ['Adam', 'adam']:
-            self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
+            optimizer = tf.train.AdamOptimizer(learning_rate=self.lr)
+        elif self.opt_type in ['LazyAdam', 'lazyadam']:
+            optimizer = tf.contrib.opt.LazyAdamOptimizer(learning_rate=self.lr)
+        elif self.opt_type in ['Adagrad', 'adagrad']:
+            optimizer = tf.train.AdagradOptimizer(learning_rate=self.lr)
         elif self.opt_type in ['SGD', 'sgd']:
-            self.opt = tf.train.GradientDescentOptimizer(learning_rate=self.lr).minimize(self.loss)
+            optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.lr)
         elif self.opt_type in ['AdaDelta']:
-            self.opt = tf.train.AdadeltaOptimizer(learning_rate=self.lr).minimize(self.loss)
+            optimizer = tf.train.AdadeltaOptimizer(learning_rate=self.lr)
         else:
-            logger.error('Optimizer is unknown')
+            logger.error('optimizer is unknown')
             exit(-1)
 
-        logger.info('finish building inter loss')
+        return optimizer
+
+    def _split_A_hat(self) -> list:
+        """Splitting attention matrix according to n_fold
 
-    def _split_A_hat(self, A: list) -> list:
-        """Splitting attention matrix list according to n_fold
+        kg triples are sorted by head, so that the rows of every fold form a contiguous range
+        of triples whose indices and values are sliced from A_indices and A_att.
         """
         A_fold_hat = []
-        fold_len = self.n_entity_attr // self.n_fold
+        n_col = tf.constant(self.n_entity_attr, dtype=tf.int64)
+        zero = tf.constant(0, dtype=tf.int64)
 
         for i_fold in range(self.n_fold):
-            start = i_fold * fold_len
-            if i_fold == self.n_fold - 1:
-                end = self.n_entity_attr
-            else:
-                end = (i_fold + 1) * fold_len
-            A_fold_hat.append(self._convert_sp_mat_to_sp_tensor(A[start:end]))
+            start, end = self.A_fold_rows[i_fold], self.A_fold_rows[i_fold + 1]
+            lo, hi = self.A_fold_offsets[i_fold], self.A_fold_offsets[i_fold + 1]
+
+            indices = self.A_indices[lo:hi] - tf.stack([start, zero])
+            # duplicated (head, tail) indices of different relations are summed by sparse matmul
+            A_fold_hat.append(tf.SparseTensor(indices, self.A_att[lo:hi], tf.stack([end - start, n_col])))
 
         return A_fold_hat
 
-    def _convert_sp_mat_to_sp_tensor(self, X: sp.spmatrix) -> tf.SparseTensor:
-        """Converting sp sparse matrix to tensor sparse matrit
+    def _get_fold_bounds(self, all_h_list: np.ndarray) -> tuple:
+        """Computing first row and first triple of every fold of A.
+
+        Folds are cut at the heads of evenly spaced triples, so that every fold holds about
+        nnz / n_fold entries (rows are never split, hence a single heavy row may skew its fold).
         """
-        coo = X.tocoo().astype(np.float32)
-        indices = np.mat([coo.row, coo.col]).transpose()
+        n_triple = len(all_h_list)
+        fold_rows = np.zeros(self.n_fold + 1, dtype=np.int64)
+        fold_rows[-1] = self.n_entity_attr
+        if n_triple > 0:
+            fold_rows[1:-1] = np.asarray(all_h_list)[np.arange(1, self.n_fold, dtype=np.int64) * n_triple // self.n_fold]
+        fold_offsets = np.searchsorted(all_h_list, fold_rows).astype(np.int64)
 
-        if len(coo.data) > 0:
-            return tf.SparseTensor(indices, coo.data, coo.shape)
-        else:
-            return tf.SparseTensor(indices=np.empty((0,2), dtype=np.int64), values=coo.data, dense_shape=coo.shape)
+        return fold_rows, fold_offsets
 
     def _build_transr_model(self) -> None:
         """Creating TransR model
         """
         logger.info('start building TransR model.')
-        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self._get_transr_inference(self.h, self.r, self.pos_t, self.neg_t)
-        self.A_kg_score = self._generate_transR_score(h=self.h, t=self.neg_t, r=self.r)
-        self.A_out = self._create_attentive_A_out()
+        self.kg_inference = self._get_transr_inference
+        self.h_e_raw = tf.reshape(tf.nn.embedding_lookup(self.weights['entity_attr_embed'], self.h), [-1, self.kg_dim])
+        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self.kg_inference(self.h, self.r, self.pos_t, self.neg_t)
+        self.A_out = self._create_attentive_A_out(self._generate_transR_score)
+        self.A_update = tf.assign(self.A_att, self.A_out.values, validate_shape=False)
         logger.info('finish building TransR model.')
 
     def _build_transe_model(self) -> None:
         """Creating TransE model
         """
         logger.info('start building TransE model.')
-        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self._get_transe_inference(self.h, self.r, self.pos_t, self.neg_t)
-        self.A_kg_score = self._generate_transE_score(h=self.h, t=self.neg_t, r=self.r)
-        self.A_out = self._create_attentive_A_out()
+        self.kg_inference = self._get_transe_inference
+        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self.kg_inference(self.h, self.r, self.pos_t, self.neg_t)
+        self.A_out = self._create_attentive_A_out(self._generate_transE_score)
+        self.A_update = tf.assign(self.A_att, self.A_out.values, validate_shape=False)
         logger.info('finish building TransE model.')
 
     def _build_transh_model(self) -> None:
         """Creating TransH model
         """
         logger.info('start building TransH model.')
-        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self._get_transh_inference(self.h, self.r, self.pos_t, self.neg_t)
-        self.A_kg_score = self._generate_transH_score(h=self.h, t=self.neg_t, r=self.r)
-        self.A_out = self._create_attentive_A_out()
+        self.kg_inference = self._get_transh_inference
+        self.h_e, self.r_e, self.pos_t_e, self.neg_t_e = self.kg_inference(self.h, self.r, self.pos_t, self.neg_t)
+        self.A_out = self._create_attentive_A_out(self._generate_transH_score)
+        self.A_update = tf.assign(self.A_att, self.A_out.values, validate_shape=False)
         logger.info('finish building TransH model.')
 
-    def _create_attentive_A_out(self) -> tf.SparseTensor:
+    def _build_attention_model(self, embedding_type: str) -> None:
+        """Creating knowledge-aware attention of embedding_type scores without kg inference.
+        """
+        logger.info('start building attention.')
+        generate_score = {'transr': self._generate_transR_score, 'transe': self._generate_transE_score,
+                          'transh': self._generate_transH_score}[embedding_type]
+        self.A_out = self._create_attentive_A_out(generate_score)
+        self.A_update = tf.assign(self.A_att, self.A_out.values, validate_shape=False)
+        logger.info('finish building attention.')
+
+    def _create_attentive_A_out(self, generate_score) -> tf.SparseTensor:
         """Creating attentive A sparse tensor.
+
+        kg scores of all triples are computed in a tf.while_loop over folds of att_fold_size
+        triples read from graph data variables, and normalized across triples of every head.
         """
-        indices = np.mat([self.all_h_list, self.all_t_list]).transpose()
+        n_triple = tf.shape(self.A_indices, out_type=tf.int64)[0]
+        n_att_fold = (n_triple + self.att_fold_size - 1) // self.att_fold_size
+
+        def _cond(i_fold, kg_score):
+            return i_fold < n_att_fold
+
+        def _body(i_fold, kg_score):
+            start = i_fold * self.att_fold_size
+            end = tf.minimum(start + self.att_fold_size, n_triple)
+            score = generate_score(h=self.A_indices[start:end, 0], t=self.A_indices[start:end, 1],
+                                   r=self.A_relations[start:end])
+            return i_fold + 1, kg_score.write(tf.cast(i_fold, tf.int32), score)
+
+        kg_score = tf.TensorArray(tf.float32, size=tf.cast(n_att_fold, tf.int32), infer_shape=False)
+        _, kg_score = tf.while_loop(_cond, _body, [tf.constant(0, dtype=tf.int64), kg_score])
+
+        # merged local ids may exceed the number of entities
+        dense_shape = tf.maximum(tf.reduce_max(self.A_rows, axis=0) + 1, self.n_entity_attr)
         # normalize the coefficients across triplets
-        return tf.sparse.softmax(tf.SparseTensor(indices, self.A_values, self.A_in.shape))
+        return tf.sparse.softmax(tf.SparseTensor(self.A_rows, kg_score.concat(), dense_shape))
+
+    def _get_att_fold_size(self, memory_mb: int) -> int:
+        """Choosing number of triples scored at once by the attention refresh within memory_mb.
+
+        Per triple, scoring keeps head and tail embeddings, their projections, the relation
+        embedding and intermediate sums (about 2 * inter_dim + 4 * kg_dim floats), besides indices.
+        """
+        if memory_mb <= 0:
+            return np.iinfo(np.int32).max
+
+        triple_cost = 4 * (2 * self.inter_dim + 4 * self.kg_dim) + 24
+        return max(1, int(memory_mb * 1024 * 1024 // triple_cost))
 
     def _generate_transE_score(self, h: tf.Tensor, t: tf.Tensor, r: tf.Tensor) -> tf.Tensor:
         """Calculating TransE score
@@ -498,21 +724,17 @@ class GNN(object):
         """Calculating TransR score.
         """
         embedding = self.weights['entity_attr_embed']
-        embedding = tf.expand_dims(embedding, 1)
 
-        # head and tail embeddings: batch_size * 1 * inter_dim
+        # head and tail embeddings: batch_size * inter_dim
         h_e = tf.nn.embedding_lookup(embedding, h)
         t_e = tf.nn.embedding_lookup(embedding, t)
 
         # relation embeddings: batch_size * kg_dim
         r_e = tf.nn.embedding_lookup(self.weights['rel_embed'], r)
 
-        # relation transform: batch_size * inter_dim * kg_dim
-        trans_r = tf.nn.embedding_lookup(self.weights['trans_w'], r)
-
-        # [batch_size, 1, inter_dim] * [batch_size, inter_dim, kg_dim] == [batch_size, 1, kg_dim]
-        h_e = tf.reshape(tf.matmul(h_e, trans_r), [-1, self.kg_dim])
-        t_e = tf.reshape(tf.matmul(t_e, trans_r), [-1, self.kg_dim])
+        # relation transform: batch_size * kg_dim
+        h_e = self._transform_by_relation(h_e, r, self.weights['trans_w'], self.n_relation)
+        t_e = self._transform_by_relation(t_e, r, self.weights['trans_w'], self.n_relation)
 
         kg_score = tf.reduce_sum(tf.multiply(t_e, tf.tanh(h_e + r_e)), axis=1)
 
@@ -580,74 +802,124 @@ class GNN(object):
         """Getting TransR embedding results.
         """
         embedding = self.weights['entity_attr_embed']
-        embedding = tf.expand_dims(embedding, 1)
-        # head and tail embeddings: batch_size * 1 * inter_dim
+        # head and tail embeddings: batch_size * inter_dim
         h_e = tf.nn.embedding_lookup(embedding, h)
         pos_t_e = tf.nn.embedding_lookup(embedding, pos_t)
         neg_t_e = tf.nn.embedding_lookup(embedding, neg_t)
-        self.h_e_raw = tf.reshape(h_e, [-1, self.kg_dim])
         
         # relation embeddings: batch_size * kg_dim
         r_e = tf.nn.embedding_lookup(self.weights['rel_embed'], r)
-        
-        # relation transform: batch_size * inter_dim * kg_dim
-        trans_r = tf.nn.embedding_lookup(self.weights['trans_w'], r)
 
-        # [batch_size, 1, inter_dim] * [batch_size, inter_dim, kg_dim] == [batch_size, 1, kg_dim]
-        h_e = tf.reshape(tf.matmul(h_e, trans_r), [-1, self.kg_dim])
-        neg_t_e = tf.reshape(tf.matmul(neg_t_e, trans_r), [-1, self.kg_dim])
+        # relation transform: batch_size * kg_dim
+        h_e = self._transform_by_relation(h_e, r, self.weights['trans_w'], self.n_relation)
+        neg_t_e = self._transform_by_relation(neg_t_e, r, self.weights['trans_w'], self.n_relation)
 
         pos_t_e_tmp = []
         for i in range(self.triple_pos_rate):
             # generate positive sub batch to calculate pos_scores
             _pos_t_e = pos_t_e[i::self.triple_pos_rate]
-            pos_t_e_tmp.append(tf.reshape(tf.matmul(_pos_t_e, trans_r), [-1, self.kg_dim]))
+            pos_t_e_tmp.append(self._transform_by_relation(_pos_t_e, r, self.weights['trans_w'], self.n_relation))
         pos_t_e = tf.concat(pos_t_e_tmp, 0)
 
         return h_e, r_e, pos_t_e, neg_t_e
 
+    @staticmethod
+    def _transform_by_relation(e: tf.Tensor, r: tf.Tensor, trans_w: tf.Tensor, n_relation: int) -> tf.Tensor:
+        """Projecting embeddings e (batch_size * inter_dim) by the transforms of relations r.
+
+        Rows are bucketed by relation and every bucket runs one dense matmul with its
+        inter_dim * kg_dim transform, instead of gathering a transform per row.
+        """
+        r = tf.cast(r, tf.int32)
+        e_buckets = tf.dynamic_partition(e, r, n_relation)
+        id_buckets = tf.dynamic_partition(tf.range(tf.shape(e)[0]), r, n_relation)
+
+        return tf.dynamic_stitch(id_buckets, [tf.matmul(e_buckets[i], trans_w[i]) for i in range(n_relation)])
+
     def _build_kg_loss(self):
         """Building kg embedding loss.
         """
+        logger.info('start building kg loss.')
+        self.kg_loss, self.reg_loss2 = self._get_kg_loss(self.h_e, self.r_e, self.pos_t_e, self.neg_t_e)
+        self.loss2 = self.kg_loss + self.reg_loss2
+
+        # Optimization
+        logger.info('adapting {} as optimization function for kg.' .format(self.opt_type))
+        self.kg_optimizer = self._get_optimizer()
+        self.opt2 = self.kg_optimizer.minimize(self.loss2)
+
+        logger.info('finish building kg loss.')
+
+    def _get_kg_loss(self, h_e: tf.Tensor, r_e: tf.Tensor, pos_t_e: tf.Tensor, neg_t_e: tf.Tensor) -> tuple:
+        """Calculating BPR loss and regularization loss of a batch of kg triple embeddings.
+        """
         def _get_kg_score(h_e, r_e, t_e):
             kg_score = tf.reduce_sum(tf.square(h_e + r_e - t_e), axis=1, keep_dims=True)
 
             return kg_score
 
-        logger.info('start building kg loss.')
-        current_batch_size = tf.shape(self.h_e)[0]
-        neg_kg_score = _get_kg_score(self.h_e, self.r_e, self.neg_t_e)
+        current_batch_size = tf.shape(h_e)[0]
+        neg_kg_score = _get_kg_score(h_e, r_e, neg_t_e)
         pos_kg_score = tf.zeros([current_batch_size, 1])
         for i in range(self.triple_pos_rate):
             # generate positive sub batch to calculate pos_kg_score
-            _pos_t_e = self.pos_t_e[i::self.triple_pos_rate]
-            pos_kg_score += _get_kg_score(self.h_e, self.r_e, _pos_t_e)
+            _pos_t_e = pos_t_e[i::self.triple_pos_rate]
+            pos_kg_score += _get_kg_score(h_e, r_e, _pos_t_e)
 
         # Using softplus to implement BPR loss
         # negatives are valid triplets; and positives are corrupted triplets 
         kg_loss = tf.reduce_mean(tf.nn.softplus(neg_kg_score - pos_kg_score), name='kg_loss')
 
-        regularizer = tf.nn.l2_loss(self.h_e) + tf.nn.l2_loss(self.r_e) + \
-                      tf.nn.l2_loss(self.pos_t_e) + tf.nn.l2_loss(self.neg_t_e)
+        regularizer = tf.nn.l2_loss(h_e) + tf.nn.l2_loss(r_e) + tf.nn.l2_loss(pos_t_e) + tf.nn.l2_loss(neg_t_e)
         regularizer = regularizer / tf.cast(current_batch_size, dtype=tf.float32)
 
-        self.kg_loss = kg_loss
-        self.reg_loss2 = self.regs[1] * regularizer
-        self.loss2 = self.kg_loss + self.reg_loss2
+        return kg_loss, self.regs[1] * regularizer
 
-        # Optimization
-        logger.info('adapting {} as optimization function for kg.' .format(self.opt_type))
-        if self.opt_type in ['Adam', 'adam']:
-            self.opt2 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2)
-        elif self.opt_type in ['SGD', 'sgd']:
-            self.opt2 = tf.train.GradientDescentOptimizer(learning_rate=self.lr).minimize(self.loss2)
-        elif self.opt_type in ['AdaDelta']:
-            self.opt2 = tf.train.AdadeltaOptimizer(learning_rate=self.lr).minimize(self.loss2)
-        else:
-            logger.error('optimizer is unknown')
-            exit(-1)
+    def _build_multi_step_train(self) -> None:
+        """Building training operations running one optimizer step per stacked batch in a tf.while_loop.
 
-        logger.info('finish building kg loss.')
+        Every iteration propagates with the weights updated by the previous iteration, so that K
+        stacked batches train exactly like K single steps. Optimizers (and their slots) are shared
+        with single-step training; losses are summed over steps.
+        """
+        logger.info('start building multi-step training')
+
+        def _inter_step_loss(e, pos_e, neg_e):
+            ea_embedding = self.create_embed(self._split_A_hat(), self.weights['entity_attr_embed'])
+            return self._get_inter_loss(tf.nn.embedding_lookup(ea_embedding, e),
+                                        tf.nn.embedding_lookup(ea_embedding, pos_e),
+                                        tf.nn.embedding_lookup(ea_embedding, neg_e))
+
+        def _kg_step_loss(h, r, pos_t, neg_t):
+            return self._get_kg_loss(*self.kg_inference(h, r, pos_t, neg_t))
+
+        self.loss_steps, self.inter_loss_steps, self.reg_loss_steps = self._create_step_loop(
+            _inter_step_loss, self.inter_optimizer, [self.e_steps, self.pos_e_steps, self.neg_e_steps])
+        self.loss2_steps, self.kg_loss_steps, self.reg_loss2_steps = self._create_step_loop(
+            _kg_step_loss, self.kg_optimizer, [self.h_steps, self.r_steps, self.pos_t_steps, self.neg_t_steps])
+
+        logger.info('finish building multi-step training')
+
+    @staticmethod
+    def _create_step_loop(step_loss, optimizer: tf.train.Optimizer, step_inputs: list) -> list:
+        """Creating a tf.while_loop minimizing step_loss over rows of step_inputs, returning summed losses.
+        """
+        n_step = tf.shape(step_inputs[0])[0]
+
+        def _cond(i, loss, base_loss, reg_loss):
+            return i < n_step
+
+        def _body(i, loss, base_loss, reg_loss):
+            step_base_loss, step_reg_loss = step_loss(*[step_input[i] for step_input in step_inputs])
+            step_loss_sum = step_base_loss + step_reg_loss
+            # the next iteration (and its variable reads) starts after the update
+            with tf.control_dependencies([optimizer.minimize(step_loss_sum)]):
+                return i + 1, loss + step_loss_sum, base_loss + step_base_loss, reg_loss + step_reg_loss
+
+        zero = tf.constant(0.)
+        outputs = tf.while_loop(_cond, _body, [tf.constant(0), zero, zero, zero], parallel_iterations=1)
+
+        return outputs[1:]
 
     def _statistics_params(self) -> None:
         """Printing model parameters.
@@ -673,54 +945,128 @@ class GNN(object):
 
         return sess.run([self.opt2, self.loss2, self.kg_loss, self.reg_loss2], feed_dict, options=run_options)
 
+    def train_inter_steps(self, sess: tf.Session, feed_dict: dict) -> tuple:
+        """Running an optimizer step per stacked interaction batch, returning losses summed over steps.
+        """
+        return sess.run([self.loss_steps, self.inter_loss_steps, self.reg_loss_steps], feed_dict)
+
+    def train_kg_steps(self, sess: tf.Session, feed_dict: dict) -> tuple:
+        """Running an optimizer step per stacked kg batch, returning losses summed over steps.
+        """
+        return sess.run([self.loss2_steps, self.kg_loss_steps, self.reg_loss2_steps], feed_dict)
+
     def eval(self, sess: tf.Session, feed_dict: dict) -> tuple:
         return sess.run(self.batch_predictions, feed_dict)
 
+    def eval_embedding(self, sess: tf.Session, subgraphs=None) -> np.ndarray:
+        """Materializing propagated embeddings of all nodes (without dropout) for the current model state.
+
+        If subgraphs (e.g., graph clusters) are given, embeddings are propagated within every
+        subgraph in turn, so that the whole graph never needs to be propagated at once. Only
+        embeddings of the local ids in sub_core (all nodes if missing) are kept per subgraph.
+        """
+        if subgraphs is None:
+            return sess.run(self.ea_embedding, feed_dict={self.mess_dropout: [0.] * self.n_layer})
+
+        ea_embedding = None
+        for subgraph in subgraphs:
+            sub_embedding = self.eval_sub_embedding(sess, subgraph)
+            if ea_embedding is None:
+                ea_embedding = np.zeros([self.n_entity_attr, sub_embedding.shape[1]], dtype=sub_embedding.dtype)
+            if 'sub_core' in subgraph:
+                ea_embedding[subgraph['sub_nodes'][subgraph['sub_core']]] = sub_embedding[subgraph['sub_core']]
+            else:
+                ea_embedding[subgraph['sub_nodes']] = sub_embedding
+
+        return ea_embedding
+
+    def eval_sub_embedding(self, sess: tf.Session, subgraph: dict) -> np.ndarray:
+        """Materializing propagated embeddings (without dropout) of the nodes of a subgraph.
+
+        Edge values are attention values of sub_edges scaled by sub_scale, or sub_values if given
+        (e.g., merged evaluation graphs whose triples are not in the graph data variables).
+        """
+        feed_dict = {
+            self.sub_nodes: subgraph['sub_nodes'],
+            self.sub_indices: subgraph['sub_indices'],
+            self.mess_dropout: [0.] * self.n_layer
+        }
+        if 'sub_values' in subgraph:
+            feed_dict[self.sub_values] = subgraph['sub_values']
+        else:
+            feed_dict[self.sub_edges] = subgraph['sub_edges']
+            feed_dict[self.sub_scale] = subgraph['sub_scale']
+
+        return sess.run(self.sub_ea_embedding, feed_dict)
+
+    @staticmethod
+    def score_pairs(ea_embedding: np.ndarray, e: np.ndarray, neg_e: np.ndarray) -> np.ndarray:
+        """Scoring (e, neg_e) pairs with materialized embeddings, identical to batch_predictions.
+        """
+        e_e = ea_embedding[np.asarray(e, dtype=np.int64)]
+        neg_e_e = ea_embedding[np.asarray(neg_e, dtype=np.int64)]
+
+        return np.sum(e_e * neg_e_e, axis=1)
+
     def eval_attention(self, sess: tf.Session) -> tuple:
-        return sess.run([self.A_vector, self.A_value])
+        return np.stack((self.all_h_list, self.all_t_list), axis=1), sess.run(self.A_att)
 
     def embedding(self, sess: tf.Session, feed_dict_r: dict, feed_dict_e: dict) -> tuple:
         trans_r = sess.run(self.h_e, feed_dict_r)
         trans_e = sess.run(self.h_e_raw, feed_dict_e)
         return trans_r, trans_e
 
-    def update_attentive_A(self, sess: tf.Session) -> None:
+    def load_graph_data(self, sess: tf.Session, meta_data: MetaData) -> None:
+        """Loading kg triples of meta_data into graph data variables.
+
+        Initial attention values are the normalized adjacency values (all_v_list). With cluster
+        sampling, graph data variables stay empty, since partitions feed their own triples.
+        """
+        self.all_h_list = meta_data.all_h_list
+        self.all_r_list = meta_data.all_r_list
+        self.all_t_list = meta_data.all_t_list
+        self.all_v_list = meta_data.all_v_list
+
+        if self.sampling == 'cluster':
+            empty = np.zeros(0, dtype=np.int64)
+            self._load_triples(sess, empty, empty, empty, np.zeros(0, dtype=np.float32))
+        else:
+            self._load_triples(sess, self.all_h_list, self.all_t_list, self.all_r_list, self.all_v_list)
+
+    def _load_triples(self, sess: tf.Session, h: np.ndarray, t: np.ndarray, r: np.ndarray, v: np.ndarray) -> None:
+        """Initializing graph data variables with (head, tail, relation, value) triples sorted by head.
+        """
+        fold_rows, fold_offsets = self._get_fold_bounds(h)
+        A_indices = np.ascontiguousarray(np.stack((h, t), axis=1), dtype=np.int64)
+
+        sess.run([self.A_indices.initializer, self.A_att.initializer, self.A_relations.initializer,
+                  self.A_fold_rows.initializer, self.A_fold_offsets.initializer],
+                 feed_dict={
+                     self.A_indices_init: A_indices,
+                     self.A_att_init: v,
+                     self.A_relations_init: r,
+                     self.A_fold_rows_init: fold_rows,
+                     self.A_fold_offsets_init: fold_offsets
+                 })
+
+    def update_attentive_A(self, sess: tf.Session, partitions=None) -> None:
         """Updating attention matrix
         
         Attention depends on kg score instead of inter score.
         Todo: design an end-to-end pipeline, where the effects of interactions can backpropagate to system entity embeddings.
-        """
-        n_fold = 50
-        fold_len = len(self.all_h_list) // n_fold
-        kg_score = []
-
-        for i_fold in range(n_fold):
-            start = i_fold * fold_len
-            if i_fold == n_fold - 1:
-                end = len(self.all_h_list)
-            else:
-                end = (i_fold + 1) * fold_len
+        Scoring, normalization and assignment run in a single session call over graph data
+        variables, so that attention never leaves tensorflow (see eval_attention).
 
-            feed_dict = {
-                self.h: self.all_h_list[start:end],
-                self.r: self.all_r_list[start:end],
-                self.neg_t: self.all_t_list[start:end] 
-            }
-
-            A_kg_score = sess.run(self.A_kg_score, feed_dict=feed_dict)
-            kg_score += list(A_kg_score)
-
-        kg_score = np.array(kg_score)
-
-        new_A = sess.run(self.A_out, feed_dict={self.A_values: kg_score})
-        new_A_values = new_A.values
-        new_A_indices = new_A.indices
-
-        rows = new_A_indices[:, 0]
-        cols = new_A_indices[:, 1]
-
-        self.A_in = sp.coo_matrix((new_A_values, (rows, cols)), 
-                                  shape=(self.n_entity_attr, self.n_entity_attr))
-                                  
-        self.A_vector = np.vstack((rows, cols)).T
-        self.A_value = new_A_values
+        If partitions (e.g., graph clusters holding every triple of their heads) are given, the
+        triples of every partition are loaded in turn and their attention is stored into its
+        'att' array instead.
+        """
+        if partitions is None:
+            sess.run(self.A_update.op)
+            return
+
+        for partition in partitions:
+            if len(partition['heads']) == 0:
+                continue
+            self._load_triples(sess, partition['heads'], partition['tails'], partition['relations'], partition['values'])
+            partition['att'][:] = sess.run(self.A_out.values)
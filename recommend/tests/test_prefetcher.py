@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from util.prefetcher import BatchPrefetcher
+
+BATCH_SIZES = {'e': 4}
+
+
+def generate_batch():
+    return {'e': np.random.randint(100, size=4)}
+
+def fail_batch():
+    raise ValueError('malformed batch')
+
+def exit_batch():
+    # a worker killed (e.g., by the OOM killer) never reports back
+    os._exit(9)
+
+
+def test_batches():
+    prefetcher = BatchPrefetcher(generate_batch, BATCH_SIZES, n_worker=2, seed=2021)
+    try:
+        for _ in range(5):
+            assert next(prefetcher)['e'].shape == (4,)
+    finally:
+        prefetcher.close()
+
+def test_failing_worker_raises():
+    prefetcher = BatchPrefetcher(fail_batch, BATCH_SIZES, n_worker=2, seed=2021)
+    try:
+        with pytest.raises(RuntimeError, match='malformed batch'):
+            next(prefetcher)
+    finally:
+        prefetcher.close()
+
+def test_dead_worker_raises():
+    prefetcher = BatchPrefetcher(exit_batch, BATCH_SIZES, n_worker=1, seed=2021)
+    try:
+        with pytest.raises(RuntimeError, match='exited with code 9'):
+            next(prefetcher)
+    finally:
+        prefetcher.close()
@@ -1,8 +1,7 @@
 import os
 import numpy as np
-import collections
 import random as rd
-from sklearn.model_selection import train_test_split
+from util.cache import DatasetCache
 from util.setting import logger
 
 
@@ -27,17 +26,26 @@ class DataBase(object):
         test_size: A float indicating the ratio of test dataset.
         val_size: A float indicating the ration of validation dataset.
         inter_file: A list including all interaction files excluding ignore interactions.
+        seed: An integer indicating the random seed of dataset splitting.
+        cache: A DatasetCache storing preprocessed data (None if the cache is disabled).
         ...
     """
+    # preprocessed arrays and scalars persisted in the dataset cache
+    cache_arrays = ['inter_indptr', 'inter_indices', 'inter_train_data', 'inter_test_data', 'inter_val_data']
+    cache_scalars = ['n_inter', 'n_train_inter', 'n_test_inter', 'n_val_inter',
+                     'n_entity', 'n_attr', 'n_relation', 'n_triple']
+
     def __init__(self, args) -> None:
         """Init DataBase class with args namespace.
         """
-        self.path = '../data/encoding/' + args.dataset
+        self.path = args.dataset_path if args.dataset_path else '../data/encoding/' + args.dataset
+        # cache entries live next to the encoding directory, e.g., ../data/encoding/<dataset>_cache
+        self.cache_root = os.path.normpath(self.path) + '_cache'
         self.args = args
         self.batch_size_gnn = args.batch_size_gnn
         self.batch_size_kg = args.batch_size_kg
-        self.batch_size_test = self.batch_size_gnn * 2
-        self.batch_size_val = self.batch_size_gnn * 2
+        self.batch_size_test = args.batch_size_eval
+        self.batch_size_val = args.batch_size_eval
         self.inter_pos_rate = args.inter_pos_rate
         self.triple_pos_rate = args.triple_pos_rate
         self.kg_file = self.path + '/train2id.txt'
@@ -47,29 +55,88 @@ class DataBase(object):
         self.test_size = args.test_size
         self.val_size = args.val_size
         self.inter_file = self._traverse_inter_file(args.ignore_inter)
+        self.seed = args.seed
+        self.inference = args.inference
+
+        # load preprocessed data from the dataset cache, otherwise build it from encoding files
+        self.cache = None
+        if not args.no_cache:
+            self.cache = DatasetCache(self.cache_root, self._get_cache_files(), self._get_cache_settings(),
+                                      args.cache_entries)
+
+        if self.cache is not None and self.cache.exists():
+            logger.info('loading preprocessed dataset from cache {}'.format(self.cache.key))
+            self._load_cache()
+        else:
+            self._build_data()
+            if self.cache is not None:
+                self._save_cache()
 
-        # system entity interactions for gnn
-        self.n_inter = 0
-        inter_data, self.inter_dict = self._load_ratings()
-        self.exist_entity = list(self.inter_dict.keys())
+        # system entities that have at least one interaction
+        inter_degree = np.diff(self.inter_indptr)
+        self.exist_entity = np.flatnonzero(inter_degree)
         self.exist_entity_size = len(self.exist_entity)
 
-        # split inter_data into training data, validation data, and testing data
-        self.n_train_inter, self.n_test_inter, self.n_val_inter = 0, 0, 0
-        self.inter_train_data, inter_test_data, inter_val_data = self._train_test_split(inter_data)
+        # sorted (e_id << 32 | neg_id) keys of the CSR index for membership tests in sampling
+        if not self.inference:
+            self.inter_keys = (np.repeat(np.arange(len(inter_degree), dtype=np.int64), inter_degree) << 32) | self.inter_indices
 
         # inter_val_e: system entities,  inter_val_neg: negative items
         self.n_batch_test, self.n_batch_val = 0, 0
-        self.inter_val_e, self.inter_val_neg  = self._get_val_data(inter_val_data)
-        self.inter_test_e, self.inter_test_neg  = self._get_test_data(inter_test_data)
+        self.inter_val_e, self.inter_val_neg  = self._get_val_data(self.inter_val_data)
+        self.inter_test_e, self.inter_test_neg  = self._get_test_data(self.inter_test_data)
+
+        # log statistic info about the dataset
+        self._log_data_info()
+
+    def _build_data(self) -> None:
+        """Building preprocessed data from encoding files.
+        """
+        # system entity interactions for gnn
+        self.n_inter = 0
+        # inter_indptr/inter_indices: CSR index of (sorted) interacted entities per system entity
+        inter_data, self.inter_indptr, self.inter_indices = self._load_ratings()
+
+        # split inter_data into training data, validation data, and testing data
+        self.n_train_inter, self.n_test_inter, self.n_val_inter = 0, 0, 0
+        self.inter_train_data, self.inter_test_data, self.inter_val_data = self._train_test_split(inter_data)
 
         # knowledge graph for translation-based embedding (e.g., TransR)
         self.n_entity, self.n_attr, self.n_relation, self.n_triple = self._load_kg_stat()
         self.n_entity_attr = self.n_entity + self.n_attr
-        self.relation_dict = self._load_kg()
+        self.kg_data = self._load_kg()
 
-        # log statistic info about the dataset
-        self._log_data_info()
+    def _get_cache_files(self) -> list:
+        """Listing encoding files whose content keys the dataset cache.
+        """
+        return [self.kg_file, self.rel_file, self.entity_file] + self.inter_file
+
+    def _get_cache_settings(self) -> dict:
+        """Listing settings that change preprocessed data.
+        """
+        return {
+            'adj_type': self.args.adj_type,
+            'test_size': self.test_size,
+            'val_size': self.val_size,
+            'seed': self.seed,
+        }
+
+    def _load_cache(self) -> None:
+        """Restoring preprocessed data from the dataset cache.
+        """
+        arrays, scalars = self.cache.load()
+        for name in self.cache_arrays:
+            setattr(self, name, arrays[name])
+        for name in self.cache_scalars:
+            setattr(self, name, scalars[name])
+        self.n_entity_attr = self.n_entity + self.n_attr
+
+    def _save_cache(self) -> None:
+        """Persisting preprocessed data into the dataset cache.
+        """
+        arrays = {name: getattr(self, name) for name in self.cache_arrays}
+        scalars = {name: int(getattr(self, name)) for name in self.cache_scalars}
+        self.cache.save(arrays, scalars)
 
     def _traverse_inter_file(self, ignore_inter: str) -> list:
         """Traverse all files and filter interaction files.
@@ -86,11 +153,23 @@ class DataBase(object):
                     inter_file.append(self.path + '/' + file)
         return inter_file
 
+    @staticmethod
+    def _shuffle_split(data: np.array, test_size: float, seed: int) -> tuple:
+        """Splitting rows of data into (train, test) parts as sklearn train_test_split does.
+
+        Testing rows are the first ceil(test_size * n) rows of a seeded permutation and training
+        rows the rest, so that splits match those of earlier runs.
+        """
+        n_test = int(np.ceil(test_size * len(data)))
+        permutation = np.random.RandomState(seed).permutation(len(data))
+
+        return data[permutation[n_test:]], data[permutation[:n_test]]
+
     def _train_test_split(self, inter_data: np.array) -> tuple:
         """Splitting interaction data into training, validating, and testing parts.
         """     
-        inter_train_data, inter_test_val_data = train_test_split(inter_data, test_size=self.test_size + self.val_size, random_state=2021)
-        inter_test_data, inter_val_data = train_test_split(inter_test_val_data, test_size=self.val_size/(self.test_size + self.val_size), random_state=2021)
+        inter_train_data, inter_test_val_data = self._shuffle_split(inter_data, self.test_size + self.val_size, self.seed)
+        inter_test_data, inter_val_data = self._shuffle_split(inter_test_val_data, self.val_size/(self.test_size + self.val_size), self.seed)
         self.n_train_inter = len(inter_train_data)
         self.n_test_inter = len(inter_test_data)
         self.n_val_inter = len(inter_val_data)
@@ -114,49 +193,44 @@ class DataBase(object):
     def _load_kg_stat(self) -> tuple:
         """Loading knowledge graph meta information.
         """
+        return self.read_kg_stat(self.path)
+
+    @staticmethod
+    def read_kg_stat(path: str) -> tuple:
+        """Reading knowledge graph meta information from the headers of encoding files in path.
+        """
         n_attr = 0
 
-        with open(self.entity_file, 'r') as f:
+        with open(path + '/entity2id.txt', 'r') as f:
             n_entity = int(f.readline().strip())
 
-        with open(self.rel_file, 'r') as f:
+        with open(path + '/relation2id.txt', 'r') as f:
             n_relation = int(f.readline().strip())
 
-        with open(self.kg_file, 'r') as f:
+        with open(path + '/train2id.txt', 'r') as f:
             n_triple = int(f.readline().strip())
 
         return n_entity, n_attr, n_relation, n_triple
 
-    def _load_kg(self) -> collections.defaultdict:
+    def _load_kg(self) -> np.ndarray:
         """Loading knowledge graph.
-        """
-        def _construct_kg(kg_np):
-            rd = collections.defaultdict(list)
-            for head, tail, relation in kg_np:
-                rd[relation].append((head, tail))
-
-            return rd
 
+        Return unique (head, tail, relation) triples.
+        """
         kg_np = np.loadtxt(self.kg_file, dtype=np.int64, skiprows=1)
         # when there is a single line in the file, need to increase the dimension
         if kg_np.ndim == 1:
             kg_np = np.array([kg_np])
         kg_np = np.unique(kg_np, axis=0)
-        relation_dict = _construct_kg(kg_np)
 
-        return relation_dict
+        return kg_np
 
     def _get_test_data(self, inter_test_data: np.array) -> tuple:
         """Generating interaction testing data by visiting inter_test_data.
         """
-        inter_test_e = np.zeros(shape=inter_test_data.size)
-        inter_test_neg = np.zeros(shape=inter_test_data.size)
-
-        for idx, inter in enumerate(inter_test_data):
-            e_id, neg_id = inter[0], inter[1]
-            inter_test_e[idx] = e_id
-            inter_test_neg[idx] = neg_id
-        
+        inter_test_e = np.asarray(inter_test_data[:, 0], dtype=np.int64)
+        inter_test_neg = np.asarray(inter_test_data[:, 1], dtype=np.int64)
+
         self.n_batch_test = self.n_test_inter // self.batch_size_test
         if self.n_batch_test == 0:
             self.n_batch_test = 1
@@ -168,14 +242,9 @@ class DataBase(object):
     def _get_val_data(self, inter_val_data: np.array) -> tuple:
         """Generating interaction validating data by visiting inter_val_data.
         """
-        inter_val_e = np.zeros(shape=inter_val_data.size)
-        inter_val_neg = np.zeros(shape=inter_val_data.size)
-        
-        for idx, inter in enumerate(inter_val_data):
-            e_id, neg_id = inter[0], inter[1]
-            inter_val_e[idx] = e_id
-            inter_val_neg[idx] = neg_id
-        
+        inter_val_e = np.asarray(inter_val_data[:, 0], dtype=np.int64)
+        inter_val_neg = np.asarray(inter_val_data[:, 1], dtype=np.int64)
+
         self.n_batch_val = self.n_val_inter // self.batch_size_val
         if  self.n_batch_val == 0:
             self.n_batch_val = 1
@@ -186,77 +255,102 @@ class DataBase(object):
 
     def _load_ratings(self) -> tuple:
         """Loading system entity interaction data.
+
+        Every line in inter2id files is 'e_id neg_id neg_id ...'. (e_id, neg_id) pairs are
+        flattened into arrays and deduplicated on packed 64-bit keys, keeping the order in
+        which pairs first appear. The interactions of every system entity are returned as
+        a CSR index (inter_indptr, inter_indices) with sorted neighbor ids.
         """
-        inter_mat = list()
-        inter_dict = dict()
-        
-        # note: interaction data might be in different inter2id files        
-        for inter_file in self.inter_file:            
-            f = open(inter_file, 'r')
-            lines = f.readlines()
-            for l in lines:
-                tmp = l.strip()
-                inters = [int(i) for i in tmp.split(' ')]
-
-                e_id, neg_ids = inters[0], inters[1:]
-                # select UNIQUE negative ids
-                neg_ids = list(set(neg_ids))
-
-                if e_id not in inter_dict:
-                    # situation: e_id first appears
-                    for neg_id in neg_ids:
-                        inter_mat.append([e_id, neg_id])
-                    if len(neg_ids) > 0:
-                        inter_dict[e_id] = neg_ids     
-                else:
-                    # situation: e_id has appeared in previous behaviors
-                    exist_neg_ids = inter_dict[e_id]
-                    diff_neg_ids = list(set(neg_ids) - set(exist_neg_ids))
-                    exist_neg_ids.extend(diff_neg_ids)
-                    for neg_id in diff_neg_ids:
-                        inter_mat.append([e_id, neg_id])
-            f.close()
-
-        inter_data = np.array(inter_mat)
+        e_list, neg_list = [], []
+
+        # note: interaction data might be in different inter2id files
+        for inter_file in self.inter_file:
+            with open(inter_file, 'r') as f:
+                # -1 marks line boundaries since entity ids are non-negative; malformed tokens
+                # raise ValueError instead of silently truncating the array
+                tokens = np.array(f.read().replace('\n', ' -1 ').split(), dtype=np.int64)
+
+            is_sep = tokens < 0
+            # the first token of every line is the system entity
+            is_head = np.concatenate(([True], is_sep[:-1])) & ~is_sep
+            is_neg = ~(is_sep | is_head)
+            line_id = np.cumsum(is_head) - 1
+
+            e_list.append(tokens[is_head][line_id[is_neg]])
+            neg_list.append(tokens[is_neg])
+
+        e_ids = np.concatenate(e_list) if e_list else np.zeros(0, dtype=np.int64)
+        neg_ids = np.concatenate(neg_list) if neg_list else np.zeros(0, dtype=np.int64)
+
+        # select UNIQUE (e_id, neg_id) pairs
+        keys = (e_ids << 32) | neg_ids
+        uniq_keys, first_idx = np.unique(keys, return_index=True)
+
+        order = np.sort(first_idx)
+        inter_data = np.stack((e_ids[order], neg_ids[order]), axis=1)
         self.n_inter = len(inter_data)
 
-        return inter_data, inter_dict
+        # uniq_keys are sorted by (e_id, neg_id), which directly forms the CSR index
+        inter_e = (uniq_keys >> 32).astype(np.int32)
+        inter_indices = (uniq_keys & 0xFFFFFFFF).astype(np.int32)
+        n_row = int(inter_e[-1]) + 1 if len(inter_e) > 0 else 0
+        inter_indptr = np.zeros(n_row + 1, dtype=np.int64)
+        np.cumsum(np.bincount(inter_e, minlength=n_row), out=inter_indptr[1:])
 
-    def _generate_train_inter_batch(self) -> tuple:
-        """Generating training batch of system interaction.
+        return inter_data, inter_indptr, inter_indices
+
+    def _sample_exclusive_batch(self, sorted_keys: np.ndarray, key_base: np.ndarray, key_stride: int, rate: int) -> np.ndarray:
+        """Sampling `rate` distinct entities for every row of a batch.
+
+        A candidate entity c of row i is rejected if the packed key key_base[i] + c * key_stride
+        exists in sorted_keys, or if c has been sampled in row i before. Samples are drawn for
+        the whole batch column by column, and only rejected rows are resampled together, which
+        keeps the distribution of sequential rejection sampling.
         """
-        def sample_neg_item_for_e(neg_items):
-            n_neg_items = len(neg_items)
-            neg_id = np.random.randint(low=0, high=n_neg_items)
-            neg_i_id = neg_items[neg_id]
+        n_row = len(key_base)
+        samples = np.zeros(shape=[n_row, rate], dtype=np.int64)
+
+        for col in range(rate):
+            pending = np.arange(n_row)
+            while len(pending) > 0:
+                candidates = np.random.randint(low=0, high=self.n_entity, size=len(pending))
+
+                # membership test against sorted packed keys
+                query = key_base[pending] + candidates * key_stride
+                if len(sorted_keys) > 0:
+                    pos = np.minimum(np.searchsorted(sorted_keys, query), len(sorted_keys) - 1)
+                    rejected = sorted_keys[pos] == query
+                else:
+                    rejected = np.zeros(len(pending), dtype=bool)
 
-            return neg_i_id
+                # entities must be distinct within a row
+                rejected |= (samples[pending, :col] == candidates[:, None]).any(axis=1)
 
-        def sample_pos_item_for_e(neg_items, rate):
-            items = []
-            while len(items) != rate:
-                pos_i_id = np.random.randint(low=0, high=self.n_entity)
-                if pos_i_id not in neg_items and pos_i_id not in items:
-                    items.append(pos_i_id)
+                samples[pending, col] = candidates
+                pending = pending[rejected]
 
-            return items
+        return samples.reshape(-1)
 
-        if self.batch_size_gnn <= self.exist_entity_size:
-            e_batch = np.array(rd.sample(self.exist_entity, self.batch_size_gnn))
-        else:
-            e_batch = np.array([rd.choice(self.exist_entity) for _ in range(self.batch_size_gnn)])
+    def _generate_train_inter_batch(self, exist_entity: np.ndarray = None) -> tuple:
+        """Generating training batch of system interaction.
 
-        neg_batch = np.zeros(shape=[self.batch_size_gnn])
-        pos_batch = np.zeros(shape=[self.batch_size_gnn * self.inter_pos_rate])
+        System entities are drawn from exist_entity (all entities with interactions by default).
+        """
+        if exist_entity is None:
+            exist_entity = self.exist_entity
+        exist_entity_size = len(exist_entity)
 
-        for idx, e in enumerate(e_batch):
-            neg_items = self.inter_dict[e]
+        if self.batch_size_gnn <= exist_entity_size:
+            e_batch = exist_entity[rd.sample(range(exist_entity_size), self.batch_size_gnn)]
+        else:
+            e_batch = exist_entity[np.random.randint(low=0, high=exist_entity_size, size=self.batch_size_gnn)]
 
-            neg_e = sample_neg_item_for_e(neg_items)
-            neg_batch[idx] = neg_e
+        # negatives: one interacted entity per system entity
+        start = self.inter_indptr[e_batch]
+        degree = self.inter_indptr[e_batch + 1] - start
+        neg_batch = self.inter_indices[start + np.random.randint(low=0, high=degree)].astype(np.int64)
 
-            pos_e_list = sample_pos_item_for_e(neg_items, self.inter_pos_rate)
-            for pos_idx, pos_e in enumerate(pos_e_list):
-                pos_batch[idx * self.inter_pos_rate + pos_idx] = pos_e
+        # positives: inter_pos_rate distinct entities without interactions per system entity
+        pos_batch = self._sample_exclusive_batch(self.inter_keys, e_batch << 32, 1, self.inter_pos_rate)
 
         return e_batch, pos_batch, neg_batch
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from util.setting import logger
+
+# bump CACHE_VERSION whenever the layout or the semantics of cached arrays change
+CACHE_VERSION = 4
+
+
+class DatasetCache(object):
+    """On-disk cache of preprocessed dataset arrays.
+
+    Every cache entry is a directory of npy shards (one per array) plus a meta.json
+    storing scalars. Entries are keyed on the content hash of the encoding files and
+    the preprocessing settings, so that changing either of them misses the cache.
+    At most max_entries entries are kept in the cache root, evicting the least
+    recently used ones.
+
+    Attributes:
+        key: A string indicating the hex digest identifying the cache entry.
+        path: A string indicating the directory of the cache entry.
+    """
+    def __init__(self, cache_root: str, key_files: list, settings: dict, max_entries: int = 2) -> None:
+        """Init DatasetCache class with cache root, encoding files, settings, and entry bound.
+        """
+        self.key = self._hash(key_files, settings)
+        self.cache_root = cache_root
+        self.path = os.path.join(cache_root, self.key)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def _hash(key_files: list, settings: dict) -> str:
+        """Hashing the content of key files and the preprocessing settings.
+        """
+        sha = hashlib.sha1()
+        sha.update(json.dumps(dict(settings, version=CACHE_VERSION), sort_keys=True).encode())
+
+        for key_file in sorted(key_files):
+            sha.update(os.path.basename(key_file).encode())
+            with open(key_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+
+        return sha.hexdigest()
+
+    def exists(self) -> bool:
+        """Checking whether the cache entry has been completely written.
+        """
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    def load(self) -> tuple:
+        """Loading arrays (memory mapped) and scalars from the cache entry.
+        """
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        arrays = dict()
+        for name in meta['arrays']:
+            arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+        # the modification time of meta.json orders entries for eviction
+        os.utime(os.path.join(self.path, 'meta.json'))
+
+        return arrays, meta['scalars']
+
+    def save(self, arrays: dict, scalars: dict) -> None:
+        """Saving arrays and scalars into the cache entry.
+
+        Shards are written into a temporary directory first and renamed at the end,
+        so that concurrent or interrupted runs never observe a partial entry.
+        """
+        tmp_path = '%s.tmp%d' % (self.path, os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(array))
+
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'arrays': sorted(arrays.keys()), 'scalars': scalars}, f)
+
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # another process has written the same entry
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        logger.debug('dataset cache saved in path: {}'.format(self.path))
+        self.prune()
+
+    def prune(self) -> None:
+        """Evicting least recently used entries beyond max_entries from the cache root.
+        """
+        entries = []
+        for key in os.listdir(self.cache_root):
+            meta_file = os.path.join(self.cache_root, key, 'meta.json')
+            if key != self.key and os.path.exists(meta_file):
+                entries.append((os.path.getmtime(meta_file), key))
+
+        for _, key in sorted(entries, reverse=True)[max(self.max_entries - 1, 0):]:
+            shutil.rmtree(os.path.join(self.cache_root, key), ignore_errors=True)
+            logger.debug('dataset cache evicted: {}'.format(key))
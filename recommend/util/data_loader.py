@@ -27,10 +27,6 @@ def load_data_engine(args, meta_data: MetaData) -> GnnLoader:
         meta_data.n_triple = data_generator.n_triple
         meta_data.n_inter = data_generator.n_inter
 
-        # load the norm matrix (used for Knowledge-aware Attention)
-        # sum is used to integrate inter_data and kg_data
-        meta_data.A_in = sum(data_generator.norm_list)
-
         # load head, relation, tail triples
         meta_data.all_h_list = data_generator.all_h_list
         meta_data.all_r_list = data_generator.all_r_list
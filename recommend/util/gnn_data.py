@@ -1,219 +1,454 @@
-import collections
+import atexit
+import os
 import random as rd
+import shutil
+import tempfile
+from typing import TYPE_CHECKING
 
 import numpy as np
-import scipy.sparse as sp
-from model.GNN import GNN
 
 from util.base_data import DataBase
 from util.setting import logger
 
+# tensorflow (GNN) and multiprocessing are imported by the code paths using them
+if TYPE_CHECKING:
+    from model.GNN import GNN
+    from util.prefetcher import BatchPrefetcher
+
+# arrays of a graph partition: its nodes, and heads, tails, relations and adjacency values of
+# the triples headed by them
+CLUSTER_ARRAYS = {'nodes': np.int64, 'heads': np.int64, 'tails': np.int64, 'relations': np.int64, 'values': np.float32}
+# number of sorted kg triples written into partitions at once
+CLUSTER_CHUNK = 1 << 22
+
+
+def _expand_ranges(start: np.ndarray, length: np.ndarray) -> np.ndarray:
+    """Concatenating [start, start + length) ranges.
+    """
+    prefix = np.cumsum(length) - length
+    return np.repeat(start - prefix, length) + np.arange(length.sum())
+
 
 class GnnLoader(DataBase):
     """Maintaining gnn data basing on DataBase class.
 
     Processing and Preparing data for GNN model.
     """
+    # sorted kg triples are persisted in the dataset cache on top of DataBase data
+    cache_arrays = DataBase.cache_arrays + ['all_h_list', 'all_r_list', 'all_t_list', 'all_v_list']
+
     def __init__(self, args):
         super().__init__(args)
 
-        # generate sparse adjacency matrices for system entity inter_train_data & relation_dict
-        adj_list, self.adj_r_list = self._get_relational_adj_list()
-
-        # generate normalized (sparse adjacency) matrices for A_in
-        self.norm_list = self._get_relational_norm_list(adj_list)
-
-        # generate kg triples dict, key is 'head', value is '(tail, relation)'
-        self.all_kg_dict = self._get_all_kg_dict()
-        self.exist_head = list(self.all_kg_dict.keys())
-        self.exist_head_size = len(self.exist_head)
-
-        # generate sorted kg triples list: head, relation, tail, value
-        self.all_h_list, self.all_r_list, self.all_t_list, self.all_v_list = self._get_all_kg_data()
-
-    def _get_all_kg_data(self) -> tuple:
-        """Sorting knowledge graph indices to satisfy tensorflow sparse matrix operations.
+        # generate kg triples index, CSR rows are 'head', columns are '(tail, relation)'
+        # (only kg batch sampling reads it, so that inference skips it)
+        if not self.inference:
+            self.kg_indptr, self.kg_tails, self.kg_relations, self.kg_keys = self._get_all_kg_index()
+            self.exist_head = np.flatnonzero(np.diff(self.kg_indptr))
+            self.exist_head_size = len(self.exist_head)
+
+        # message dropout is fed at every training step
+        self.mess_dropout = eval(args.mess_dropout)
+
+        # CSR row pointer of sorted kg triples for neighbor-sampled subgraphs
+        self.sampling = args.sampling
+        if self.sampling == 'neighbor' and not self.inference:
+            self.fanouts = eval(args.fanouts)
+            if len(self.fanouts) != len(eval(args.layer_size)):
+                logger.error('fanouts should have one entry per gnn layer')
+                exit(-1)
+            self.A_indptr = np.searchsorted(self.all_h_list, np.arange(self.n_entity_attr + 1)).astype(np.int64)
+        elif self.sampling == 'cluster':
+            self.n_cluster = min(args.n_cluster, self.n_entity_attr)
+            self.cluster_per_batch = min(args.cluster_per_batch, self.n_cluster)
+            self.node_cluster, self.clusters = self._get_cluster_partitions()
+            # attention values of partition triples, refreshed by GNN.update_attentive_A
+            self.cluster_att = [np.array(cluster['values']) for cluster in self.clusters]
+
+    def _build_data(self) -> None:
+        """Building normalized relational adjacency and sorted kg triples on top of base data.
         """
-        def _reorder_list(org_list, order):
-            new_list = np.array(org_list)
-            new_list = new_list[order]
-            return new_list
-
-        all_h_list, all_t_list, all_r_list, all_v_list = [], [], [], []
+        super()._build_data()
 
-        for l_id, norm in enumerate(self.norm_list):
-            all_h_list += list(norm.row)
-            all_t_list += list(norm.col)
-            # norm.data stores A_in
-            all_v_list += list(norm.data)
-            all_r_list += [self.adj_r_list[l_id]] * len(norm.row)
+        # generate sorted kg triples list (head, relation, tail, value), values are the normalized
+        # adjacency of inter_data and kg_data, which propagation reads as sparse tensors
+        self.all_h_list, self.all_r_list, self.all_t_list, self.all_v_list = self._get_relational_norm_adj()
 
-        assert len(all_h_list) == sum([len(norm.data) for norm in self.norm_list])
+    def _get_relational_norm_adj(self) -> tuple:
+        """Generating normalized relational adjacency for system entity inter_train_data & kg_data.
 
-        # tensorflow.sparse.softmax in GNN requires indices sorted in the canonical
-        # lexicographic order, so that we sort kg triples
-        logger.info('start sorting indices in kg triples...')
-        org_h_dict = dict()
-
-        for idx, h in enumerate(all_h_list):
-            if h not in org_h_dict.keys():
-                org_h_dict[h] = [[], [], []]
-
-            org_h_dict[h][0].append(all_t_list[idx])
-            org_h_dict[h][1].append(all_r_list[idx])
-            org_h_dict[h][2].append(all_v_list[idx])
-        logger.debug('reorganizing kg data done.')
-
-        # sort tail for every head in sorted_h_dict
-        sorted_h_dict = dict()
-        for h in org_h_dict.keys():
-            org_t_list, org_r_list, org_v_list = org_h_dict[h]
-            sort_t_list = np.array(org_t_list)
-            sort_order = np.argsort(sort_t_list)
-
-            sort_t_list = _reorder_list(org_t_list, sort_order)
-            sort_r_list = _reorder_list(org_r_list, sort_order)
-            sort_v_list = _reorder_list(org_v_list, sort_order)
-
-            sorted_h_dict[h] = [sort_t_list, sort_r_list, sort_v_list]
-        logger.debug('sorting (tail,relation) in heads done')
-
-        # sort head in sorted_h_dict
-        od = collections.OrderedDict(sorted(sorted_h_dict.items()))
-
-        new_h_list, new_t_list, new_r_list, new_v_list = [], [], [], []
-        for h, vals in od.items():
-            new_h_list += [h] * len(vals[0])
-            new_t_list += list(vals[0])
-            new_r_list += list(vals[1])
-            new_v_list += list(vals[2])
-
-        assert sum(new_h_list) == sum(all_h_list)
-        assert sum(new_t_list) == sum(all_t_list)
-        assert sum(new_r_list) == sum(all_r_list)
-        logger.debug('sorting head done.')
-        logger.info('finish sorting indices in kg triples')
-
-        return new_h_list, new_r_list, new_t_list, new_v_list
-
-    def _get_all_kg_dict(self) -> collections.defaultdict:
-        """Generating knowledge graph triples dict.
-
-        key: head, value: (tail, relation)
+        System interactions are relation 0 and kg relations are shifted by 1. Every triple
+        (head, relation, tail) is an adjacency entry of its relation, normalized by degrees
+        of head (and tail) within the same relation via grouped reductions:
+            si: 1/Nh, bi: 1/(Nh*Nt)^(1/2)
+        Triples are returned sorted in the canonical lexicographic order (head, tail) required
+        by tensorflow.sparse.softmax in GNN; relation breaks ties.
         """
-        all_kg_dict = collections.defaultdict(list)
+        n_all = self.n_entity_attr
 
-        for l_id, norm in enumerate(self.norm_list):
-            rows = norm.row
-            cols = norm.col
-            for i_id in range(len(rows)):
-                head = rows[i_id]
-                tail = cols[i_id]
-                relation = self.adj_r_list[l_id]
+        # Todo: (Optional) inverse directions (e.g., ActedBy for ActorOf)
+        logger.info('start converting graph info into relational adjacency...')
+        all_h = np.concatenate((self.inter_train_data[:, 0], self.kg_data[:, 0])).astype(np.int64)
+        all_t = np.concatenate((self.inter_train_data[:, 1], self.kg_data[:, 1])).astype(np.int64)
+        all_r = np.concatenate((np.zeros(len(self.inter_train_data), dtype=np.int64), self.kg_data[:, 2] + 1))
+        logger.info('finish converting graph info into relational adjacency.')
 
-                all_kg_dict[head].append((tail, relation))
+        logger.info('start generating normalized adjacency matrix with {}...' .format(self.args.adj_type))
+        # number of entries in every (relation, head) row
+        row_keys, row_inverse, row_degree = np.unique(all_r * n_all + all_h, return_inverse=True, return_counts=True)
+        h_degree = row_degree[row_inverse.reshape(-1)].astype(np.float64)
 
-        return all_kg_dict
+        if self.args.adj_type == 'bi':
+            # row degree of tails in the same relation (0 if tails have no entries)
+            tail_keys = all_r * n_all + all_t
+            pos = np.minimum(np.searchsorted(row_keys, tail_keys), len(row_keys) - 1)
+            t_degree = np.where(row_keys[pos] == tail_keys, row_degree[pos], 0).astype(np.float64)
 
-    def _get_relational_norm_list(self, adj_list: list) -> list:
-        """Generating normalized matrices for sparse adjacency in adj_list.
-        """
+            all_v = np.zeros(len(all_h), dtype=np.float64)
+            has_degree = t_degree > 0
+            all_v[has_degree] = np.power(h_degree[has_degree] * t_degree[has_degree], -0.5)
 
-        # Init for 1/Nt
-        def _si_norm(adj):
-            rowsum = np.array(adj.sum(axis=1))
-            # It is reasonable for np.power(rowsum, -1).flatten() to trigger divide by zero encountered warning
-            d_inv = np.power(rowsum, -1).flatten()
-            d_inv[np.isinf(d_inv)] = 0.
-            d_mat_inv = sp.diags(d_inv)
-            norm_adj = d_mat_inv.dot(adj)
-
-            return norm_adj.tocoo()
-
-        # Init for 1/(Nt*Nh)^(1/2)
-        def _bi_norm(adj):
-            rowsum = np.array(adj.sum(axis=1))
-            d_inv_sqrt = np.power(rowsum, -0.5).flatten()
-            d_inv_sqrt[np.isinf(d_inv_sqrt)] = 0.
-            d_mat_inv_sqrt = sp.diags(d_inv_sqrt)
-            bi_norm = d_mat_inv_sqrt.dot(adj).dot(d_mat_inv_sqrt)
-
-            return bi_norm.tocoo()
-        logger.info('start generating normalized adjacency matrix with {}...' .format(self.args.adj_type))
-        if self.args.adj_type == 'bi':
-            norm_list = [_bi_norm(adj) for adj in adj_list]
+            # entries of zero-degree tails vanish as in a sparse product
+            all_h, all_t, all_r, all_v = all_h[has_degree], all_t[has_degree], all_r[has_degree], all_v[has_degree]
             logger.debug('generating bi-normalized adjacency matrix done.')
         else:
+            all_v = 1. / h_degree
             logger.debug('generating si-normalized adjacency matrix done.')
-            norm_list = [_si_norm(adj) for adj in adj_list]
-        
         logger.info('finish generating normalized adjacency matrix.')
 
-        return norm_list
+        logger.info('start sorting indices in kg triples...')
+        order = np.lexsort((all_r, all_t, all_h))
+        logger.info('finish sorting indices in kg triples')
+
+        return all_h[order], all_r[order], all_t[order], all_v[order].astype(np.float32)
+
+    def _get_all_kg_index(self) -> tuple:
+        """Generating CSR index of knowledge graph triples.
 
-    def _get_relational_adj_list(self) -> tuple:
-        """Generating sparse adjacency matrices for system entity inter_train_data & relation_dict
+        row: head, columns: (tail, relation) sorted by packed 64-bit keys
+        ((head * n_entity_attr + tail) * n_kg_relation + relation), which are kept for membership tests.
         """
-        def _np_mat2sp_adj(np_mat, row_pre=0, col_pre=0):
-            n_all = self.n_entity_attr
+        all_h = np.asarray(self.all_h_list, dtype=np.int64)
+        all_t = np.asarray(self.all_t_list, dtype=np.int64)
+        all_r = np.asarray(self.all_r_list, dtype=np.int64)
 
-            # to-node interaction: A: A->B
-            a_rows = np_mat[:, 0] + row_pre # all As
-            a_cols = np_mat[:, 1] + col_pre # all Bs
+        # relation ids in triples include system interactions (0)
+        self.n_kg_relation = int(all_r.max()) + 1 if len(all_r) > 0 else 1
 
-            # must use float 1. (int 1 is not allowed)
-            a_vals = [1.] * len(a_rows)
+        kg_keys = np.sort((all_h * self.n_entity_attr + all_t) * self.n_kg_relation + all_r)
+        kg_heads = kg_keys // (self.n_entity_attr * self.n_kg_relation)
+        kg_tails = (kg_keys // self.n_kg_relation) % self.n_entity_attr
+        kg_relations = kg_keys % self.n_kg_relation
 
-            # from-node interaction: A: B->A
-            b_rows = a_cols
-            b_cols = a_rows
-            b_vals = [1.] * len(b_rows)
+        kg_indptr = np.zeros(self.n_entity_attr + 1, dtype=np.int64)
+        np.cumsum(np.bincount(kg_heads, minlength=self.n_entity_attr), out=kg_indptr[1:])
 
-            a_adj = sp.coo_matrix((a_vals, (a_rows, a_cols)), shape=(n_all, n_all))
-            b_adj = sp.coo_matrix((b_vals, (b_rows, b_cols)), shape=(n_all, n_all))
+        return kg_indptr, kg_tails, kg_relations, kg_keys
 
-            return a_adj, b_adj
+    def _get_cluster_partitions(self) -> tuple:
+        """Partitioning kg triples into clusters and loading partitions memory mapped.
 
-        adj_mat_list = []
-        adj_r_list = []
+        Partitions are kept next to the dataset cache entry, or in a temporary directory
+        removed at exit without cache. Returns the cluster of every node and the arrays
+        (CLUSTER_ARRAYS) of every partition.
+        """
+        if self.cache is not None:
+            cluster_path = os.path.join(self.cache.path, 'clusters_%d' % self.n_cluster)
+        else:
+            cluster_path = tempfile.mkdtemp(prefix='clusters_')
+            atexit.register(shutil.rmtree, cluster_path, ignore_errors=True)
 
-        logger.info('start converting graph info into sparse adjacency matrix...')
-        # Todo: (Optional) r_inv, k_inv are for inverse directions (e.g., ActedBy for ActorOf)
-        r, r_inv = _np_mat2sp_adj(self.inter_train_data)
-        adj_mat_list.append(r)
-        adj_r_list.append(0)
-        # adj_mat_list.append(r_inv)
-        # adj_r_list.append(self.n_relation + 1)
+        # node_cluster is written last and marks complete partitions
+        node_file = os.path.join(cluster_path, 'node_cluster.npy')
+        if os.path.exists(node_file):
+            logger.info('loading graph partitions from {}'.format(cluster_path))
+        else:
+            self._write_cluster_partitions(cluster_path, node_file)
 
-        logger.debug('converting system interactions into sparse adjacency matrix done.')
+        clusters = []
+        for c in range(self.n_cluster):
+            part_path = os.path.join(cluster_path, 'part_%d' % c)
+            clusters.append({name: np.load(os.path.join(part_path, name + '.npy'), mmap_mode='r')
+                             for name in CLUSTER_ARRAYS})
 
-        for r_id in self.relation_dict.keys():
-            k, k_inv = _np_mat2sp_adj(np.array(self.relation_dict[r_id]))
-            adj_mat_list.append(k)
-            adj_r_list.append(r_id + 1)
-            # adj_mat_list.append(k_inv)
-            # adj_r_list.append(r_id + 1 + self.n_relation + 1)
+        return np.load(node_file, mmap_mode='r'), clusters
 
-        logger.debug('converting knowledge graph into sparse adjacency matrix done.')
+    def _write_cluster_partitions(self, cluster_path: str, node_file: str) -> None:
+        """Partitioning kg triples into clusters of balanced triple counts and storing them on disk.
 
-        logger.info('finish converting graph info into sparse adjacency matrix.')
+        Clusters are grown breadth-first (see _grow_clusters), which keeps linked nodes in
+        the same cluster. Every partition stores its nodes and the triples headed by them, which
+        are copied chunk by chunk from the sorted kg triples, so that they stay sorted and no
+        adjacency matrix of the whole graph is built.
+        """
+        logger.info('start partitioning graph into {} clusters...'.format(self.n_cluster))
+        out_indptr = np.searchsorted(self.all_h_list, np.arange(self.n_entity_attr + 1)).astype(np.int64)
+        out_degree = np.diff(out_indptr)
+        node_cluster = self._grow_clusters(out_indptr)
+
+        node_order = np.argsort(node_cluster, kind='stable')
+        node_bounds = np.concatenate(([0], np.cumsum(np.bincount(node_cluster, minlength=self.n_cluster))))
+        edge_counts = np.bincount(node_cluster, weights=out_degree, minlength=self.n_cluster).astype(np.int64)
+
+        parts = []
+        for c in range(self.n_cluster):
+            part_path = os.path.join(cluster_path, 'part_%d' % c)
+            os.makedirs(part_path, exist_ok=True)
+            np.save(os.path.join(part_path, 'nodes.npy'), node_order[node_bounds[c]: node_bounds[c + 1]].astype(np.int64))
+            parts.append({name: np.lib.format.open_memmap(os.path.join(part_path, name + '.npy'), mode='w+',
+                                                          dtype=dtype, shape=(int(edge_counts[c]),))
+                          for name, dtype in CLUSTER_ARRAYS.items() if name != 'nodes'})
+
+        triples = {'heads': self.all_h_list, 'tails': self.all_t_list, 'relations': self.all_r_list, 'values': self.all_v_list}
+        filled = np.zeros(self.n_cluster, dtype=np.int64)
+        for start in range(0, len(self.all_h_list), CLUSTER_CHUNK):
+            chunk = {name: np.asarray(array[start: start + CLUSTER_CHUNK]) for name, array in triples.items()}
+            edge_cluster = node_cluster[chunk['heads']]
+            edge_order = np.argsort(edge_cluster, kind='stable')
+            edge_bounds = np.concatenate(([0], np.cumsum(np.bincount(edge_cluster, minlength=self.n_cluster))))
+
+            for c in np.flatnonzero(np.diff(edge_bounds)):
+                edges = edge_order[edge_bounds[c]: edge_bounds[c + 1]]
+                for name, array in chunk.items():
+                    parts[c][name][filled[c]: filled[c] + len(edges)] = array[edges]
+                filled[c] += len(edges)
+
+        for part in parts:
+            for array in part.values():
+                array.flush()
+        del parts
+
+        np.save(node_file, node_cluster)
+        logger.info('finish partitioning graph into {} clusters.'.format(self.n_cluster))
+
+    def _grow_clusters(self, out_indptr: np.ndarray) -> np.ndarray:
+        """Growing clusters of balanced triple counts breadth-first over kg triples in both directions.
+
+        A cluster grows from a seed level by level and takes nodes of its last level until it
+        holds its share of triples (a node weighs its out-degree plus one); the next cluster is
+        seeded next to it. Out-neighbors are ranges of the sorted kg triples (out_indptr) and
+        in-neighbors ranges of heads sorted by tail. Nodes without triples fill the last clusters.
+        """
+        n_all = self.n_entity_attr
+        in_indptr = np.zeros(n_all + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.all_t_list, minlength=n_all), out=in_indptr[1:])
+        in_heads = np.sort(np.asarray(self.all_t_list, dtype=np.int64) * n_all + self.all_h_list) % n_all
+        out_degree, in_degree = np.diff(out_indptr), np.diff(in_indptr)
+        weight = out_degree + 1
+        target = max(1, -(-int(weight.sum()) // self.n_cluster))
+
+        # clusters of unassigned nodes are -1; the frontier is a queue of unassigned nodes
+        node_cluster = np.full(n_all, -1, dtype=np.int32)
+        in_frontier = np.zeros(n_all, dtype=bool)
+        # last position of every node among gathered neighbors, deduplicating them without sorting
+        last_pos = np.zeros(n_all, dtype=np.int64)
+        seeds = np.flatnonzero(out_degree + in_degree)
+        cluster, filled, i_seed = 0, 0, 0
+        frontier = np.zeros(0, dtype=np.int64)
+        while True:
+            if len(frontier) == 0:
+                # skip seeds assigned by previous clusters, a window at a time
+                while i_seed < len(seeds):
+                    window = node_cluster[seeds[i_seed: i_seed + 4096]] < 0
+                    if window.any():
+                        i_seed += int(np.argmax(window))
+                        break
+                    i_seed += len(window)
+                if i_seed >= len(seeds):
+                    break
+                frontier = seeds[i_seed: i_seed + 1]
+                in_frontier[frontier] = True
+
+            # take frontier nodes fitting into the cluster (at least one), the last cluster takes all
+            frontier_weight = np.cumsum(weight[frontier])
+            n_take = len(frontier)
+            if cluster < self.n_cluster - 1:
+                n_take = max(1, int(np.searchsorted(frontier_weight, target - filled, side='right')))
+            take = frontier[:n_take]
+            node_cluster[take] = cluster
+            in_frontier[take] = False
+            filled += int(frontier_weight[n_take - 1])
+
+            neighbors = np.concatenate((self.all_t_list[_expand_ranges(out_indptr[take], out_degree[take])],
+                                        in_heads[_expand_ranges(in_indptr[take], in_degree[take])]))
+            neighbors = neighbors[(node_cluster[neighbors] < 0) & ~in_frontier[neighbors]]
+            last_pos[neighbors] = np.arange(len(neighbors))
+            neighbors = neighbors[last_pos[neighbors] == np.arange(len(neighbors))]
+            in_frontier[neighbors] = True
+            frontier = np.concatenate((frontier[n_take:], neighbors))
+            if filled >= target and cluster < self.n_cluster - 1:
+                # seed the next cluster next to the filled one
+                cluster, filled = cluster + 1, 0
+                in_frontier[frontier[1:]] = False
+                frontier = frontier[:1]
+
+        isolated = np.flatnonzero(node_cluster < 0)
+        node_cluster[isolated] = np.minimum(cluster + (filled + np.arange(len(isolated))) // target, self.n_cluster - 1)
+
+        return node_cluster
+
+    def _load_clusters(self, clusters: list, halo: bool = False) -> tuple:
+        """Loading the union of partitions as sorted nodes and (head, tail, attention) triples.
+
+        Triples whose tails fall outside the partitions are dropped, unless halo is set: their
+        tails are then 1-hop halo nodes, which are returned separately.
+        """
+        nodes = np.sort(np.concatenate([self.clusters[c]['nodes'] for c in clusters]))
+        heads = np.concatenate([self.clusters[c]['heads'] for c in clusters])
+        tails = np.concatenate([self.clusters[c]['tails'] for c in clusters])
+        values = np.concatenate([self.cluster_att[c] for c in clusters])
 
-        # n_relations = (n_relations + 1) * 2 if inverse relations are enabled
-        self.n_relations = len(adj_r_list)
+        if halo:
+            halo_nodes = np.setdiff1d(tails, nodes)
+        else:
+            keep = np.isin(self.node_cluster[tails], clusters)
+            heads, tails, values = heads[keep], tails[keep], values[keep]
+            halo_nodes = np.zeros(0, dtype=np.int64)
+
+        return nodes, halo_nodes, heads, tails, values
+
+    @staticmethod
+    def _get_subgraph(sub_nodes: np.ndarray, sub_heads: np.ndarray, sub_tails: np.ndarray) -> dict:
+        """Generating subgraph feeds with local (head, tail) indices into sorted sub_nodes.
+        """
+        subgraph = {}
+        subgraph['sub_nodes'] = sub_nodes
+        subgraph['sub_indices'] = np.stack((np.searchsorted(sub_nodes, sub_heads),
+                                            np.searchsorted(sub_nodes, sub_tails)), axis=1)
 
-        return adj_mat_list, adj_r_list
+        return subgraph
 
     def generate_train_batch(self) -> dict:
         """Generating training batch of system interactions for GNN.
         """
         batch_data = {}
-        e_batch, pos_e_batch, neg_e_batch = self._generate_train_inter_batch()
+        if self.sampling == 'cluster':
+            # system entities are drawn from a random union of clusters
+            nodes, _, heads, tails, values = self._load_clusters(rd.sample(range(self.n_cluster), self.cluster_per_batch))
+            exist_entity = np.intersect1d(self.exist_entity, nodes, assume_unique=True)
+            e_batch, pos_e_batch, neg_e_batch = self._generate_train_inter_batch(exist_entity if len(exist_entity) > 0 else None)
+        else:
+            e_batch, pos_e_batch, neg_e_batch = self._generate_train_inter_batch()
         batch_data['e_batch'] = e_batch
         batch_data['pos_e_batch'] = pos_e_batch
         batch_data['neg_e_batch'] = neg_e_batch
 
+        if self.sampling == 'neighbor':
+            seeds = np.concatenate((e_batch, pos_e_batch, neg_e_batch))
+            batch_data.update(self._sample_neighbor_subgraph(seeds))
+        elif self.sampling == 'cluster':
+            # samples outside the clusters join the subgraph as isolated nodes
+            sub_nodes = np.union1d(nodes, np.concatenate((e_batch, pos_e_batch, neg_e_batch)))
+            batch_data.update(self._get_subgraph(sub_nodes, heads, tails))
+            batch_data['sub_values'] = values
+
         return batch_data
 
+    def generate_eval_subgraphs(self):
+        """Generating subgraphs of every cluster to materialize evaluation embeddings cluster by cluster.
+
+        Every subgraph holds all triples headed by the nodes of its cluster and their tails as
+        halo nodes, so that the first layer of propagation is exact; deeper layers see halo
+        nodes without their own triples. Only embeddings of cluster nodes (sub_core) are kept.
+        Returns None if the whole graph is propagated at once (no cluster sampling).
+        """
+        if self.sampling != 'cluster':
+            return None
+
+        def _iterate():
+            for c in range(self.n_cluster):
+                nodes, halo_nodes, heads, tails, values = self._load_clusters([c], halo=True)
+                sub_nodes = np.union1d(nodes, halo_nodes)
+                subgraph = self._get_subgraph(sub_nodes, heads, tails)
+                subgraph['sub_values'] = values
+                subgraph['sub_core'] = np.searchsorted(sub_nodes, nodes)
+                yield subgraph
+
+        return _iterate()
+
+    def generate_attention_partitions(self):
+        """Generating kg triples of every cluster to refresh attention cluster by cluster.
+
+        Attention is normalized across the triples of every head, which all fall in the cluster
+        of the head, so that refreshing it per cluster is exact. Returns None if attention is
+        refreshed over the whole graph at once (no cluster sampling).
+        """
+        if self.sampling != 'cluster':
+            return None
+
+        def _iterate():
+            for cluster, att in zip(self.clusters, self.cluster_att):
+                yield dict(cluster, att=att)
+
+        return _iterate()
+
+    def _sample_neighbor_subgraph(self, seeds: np.ndarray) -> dict:
+        """Sampling k-hop subgraph of seed nodes with fanouts per layer.
+
+        At hop k, every node not expanded yet keeps all its edges if its degree is at most
+        fanouts[k]; otherwise fanouts[k] edges are sampled with replacement and scaled by
+        degree/fanouts[k], so that the weighted neighbor sum stays unbiased.
+        """
+        frontier = np.unique(seeds)
+        expanded = np.zeros(0, dtype=np.int64)
+        edge_list, scale_list = [], []
+
+        for fanout in self.fanouts:
+            frontier = np.setdiff1d(frontier, expanded, assume_unique=True)
+            start = self.A_indptr[frontier]
+            degree = self.A_indptr[frontier + 1] - start
+            is_full = degree <= fanout
+
+            # small-degree nodes keep all edges
+            full_edges = _expand_ranges(start[is_full], degree[is_full])
+            edge_list.append(full_edges)
+            scale_list.append(np.ones(len(full_edges), dtype=np.float32))
+
+            # large-degree nodes sample fanout edges
+            big_start = np.repeat(start[~is_full], fanout)
+            big_degree = np.repeat(degree[~is_full], fanout)
+            edge_list.append(big_start + np.random.randint(low=0, high=np.maximum(big_degree, 1)))
+            scale_list.append((big_degree / fanout).astype(np.float32))
+
+            expanded = np.union1d(expanded, frontier)
+            frontier = np.unique(self.all_t_list[np.concatenate(edge_list[-2:])])
+
+        sub_nodes = np.union1d(expanded, frontier)
+        sub_edges = np.concatenate(edge_list)
+
+        subgraph = self._get_subgraph(sub_nodes, self.all_h_list[sub_edges], self.all_t_list[sub_edges])
+        subgraph['sub_edges'] = sub_edges
+        subgraph['sub_scale'] = np.concatenate(scale_list)
+
+        return subgraph
+
+    def prefetch_train_batches(self, n_worker: int) -> 'BatchPrefetcher':
+        """Generating training batches of system interactions in n_worker background processes.
+        """
+        if self.sampling != 'full':
+            logger.error('prefetching batches only supports full-graph propagation')
+            exit(-1)
+
+        batch_sizes = {
+            'e_batch': self.batch_size_gnn,
+            'pos_e_batch': self.batch_size_gnn * self.inter_pos_rate,
+            'neg_e_batch': self.batch_size_gnn
+        }
+        from util.prefetcher import BatchPrefetcher
+        return BatchPrefetcher(self.generate_train_batch, batch_sizes, n_worker, self.seed)
+
+    def prefetch_train_kg_batches(self, n_worker: int) -> 'BatchPrefetcher':
+        """Generating training batches of kg triples in n_worker background processes.
+        """
+        batch_sizes = {
+            'h_batch': self.batch_size_kg,
+            'r_batch': self.batch_size_kg,
+            'pos_t_batch': self.batch_size_kg * self.triple_pos_rate,
+            'neg_t_batch': self.batch_size_kg
+        }
+        from util.prefetcher import BatchPrefetcher
+        return BatchPrefetcher(self.generate_train_kg_batch, batch_sizes, n_worker, self.seed)
+
     def generate_test_batch(self, i_batch: int) -> dict:
         """Generating testing batch of system interactions for GNN.
         """
@@ -256,58 +491,83 @@ class GnnLoader(DataBase):
     def _generate_train_kg_batch(self) -> tuple:
         """Sampling system interactions for kg training (e.g., TransR).
         """
-        def sample_neg_triple_for_h(neg_triples):
-            n_neg_triples = len(neg_triples)
-            neg_id = np.random.randint(low=0, high=n_neg_triples)
-            neg_r = neg_triples[neg_id][1]
-            neg_t = neg_triples[neg_id][0]
-
-            return neg_r, neg_t
-
-        def sample_pos_triple_for_h(neg_triples, r, rate):
-            pos_t = []
-            while len(pos_t) != rate:
-                t = np.random.randint(low=0, high=self.n_entity)
-                if (t, r) not in neg_triples and t not in pos_t:
-                    pos_t.append(t)
-
-            return pos_t
-
         if self.batch_size_kg <= self.exist_head_size:
-            h_batch = np.array(rd.sample(self.exist_head, self.batch_size_kg))
+            h_batch = self.exist_head[rd.sample(range(self.exist_head_size), self.batch_size_kg)]
         else:
-            h_batch = np.array([rd.choice(self.exist_head) for _ in range(self.batch_size_kg)])
-
-        r_batch = np.zeros(shape=[self.batch_size_kg])
-        neg_t_batch = np.zeros(shape=[self.batch_size_kg])
-        pos_t_batch = np.zeros(shape=[self.batch_size_kg * self.triple_pos_rate])
+            h_batch = self.exist_head[np.random.randint(low=0, high=self.exist_head_size, size=self.batch_size_kg)]
 
-        for idx, h in enumerate(h_batch):
-            neg_triples = self.all_kg_dict[h]
+        # negatives: one existing (tail, relation) per head
+        start = self.kg_indptr[h_batch]
+        degree = self.kg_indptr[h_batch + 1] - start
+        neg_id = start + np.random.randint(low=0, high=degree)
+        r_batch = self.kg_relations[neg_id]
+        neg_t_batch = self.kg_tails[neg_id]
 
-            neg_r, neg_t = sample_neg_triple_for_h(neg_triples)
-            r_batch[idx] = neg_r
-            neg_t_batch[idx] = neg_t
-
-            pos_t_list = sample_pos_triple_for_h(neg_triples, neg_r, self.triple_pos_rate)
-            for pos_idx, pos_t in enumerate(pos_t_list):
-                pos_t_batch[idx * self.triple_pos_rate + pos_idx] = pos_t
+        # positives: triple_pos_rate distinct tails that do not form (head, tail, relation) triples
+        key_base = h_batch * self.n_entity_attr * self.n_kg_relation + r_batch
+        pos_t_batch = self._sample_exclusive_batch(self.kg_keys, key_base, self.n_kg_relation, self.triple_pos_rate)
 
         return h_batch, r_batch, pos_t_batch, neg_t_batch
 
-    def generate_train_feed_dict(self, model: GNN, batch_data: dict) -> dict:
+    def generate_train_feed_dict(self, model: 'GNN', batch_data: dict) -> dict:
         """Generating feed dict for GNN model training.
         """
         feed_dict = {
             model.e: batch_data['e_batch'],
             model.pos_e: batch_data['pos_e_batch'],
             model.neg_e: batch_data['neg_e_batch'],
-            model.mess_dropout: eval(self.args.mess_dropout)
+            model.mess_dropout: self.mess_dropout
+        }
+
+        if 'sub_nodes' in batch_data:
+            sub_nodes = batch_data['sub_nodes']
+            feed_dict.update({
+                model.sub_nodes: sub_nodes,
+                model.sub_indices: batch_data['sub_indices'],
+                model.sub_e: np.searchsorted(sub_nodes, batch_data['e_batch']),
+                model.sub_pos_e: np.searchsorted(sub_nodes, batch_data['pos_e_batch']),
+                model.sub_neg_e: np.searchsorted(sub_nodes, batch_data['neg_e_batch'])
+            })
+            # cluster batches feed their attention values, sampled batches gather them
+            if 'sub_values' in batch_data:
+                feed_dict[model.sub_values] = batch_data['sub_values']
+            else:
+                feed_dict[model.sub_edges] = batch_data['sub_edges']
+                feed_dict[model.sub_scale] = batch_data['sub_scale']
+
+        return feed_dict
+
+    def generate_pipeline_feed_dict(self, model: 'GNN') -> dict:
+        """Generating feed dict for GNN model training with in-graph sampled batches.
+        """
+        feed_dict = {
+            model.mess_dropout: self.mess_dropout
+        }
+        return feed_dict
+
+    def generate_train_steps_feed_dict(self, model: 'GNN', batch_list: list) -> dict:
+        """Generating feed dict for GNN model training over stacked batches (one per step).
+        """
+        feed_dict = {
+            model.e_steps: np.stack([batch_data['e_batch'] for batch_data in batch_list]),
+            model.pos_e_steps: np.stack([batch_data['pos_e_batch'] for batch_data in batch_list]),
+            model.neg_e_steps: np.stack([batch_data['neg_e_batch'] for batch_data in batch_list]),
+            model.mess_dropout: self.mess_dropout
         }
+        return feed_dict
 
+    def generate_train_kg_steps_feed_dict(self, model: 'GNN', batch_list: list) -> dict:
+        """Generating feed dict for kg embedding training over stacked batches (one per step).
+        """
+        feed_dict = {
+            model.h_steps: np.stack([batch_data['h_batch'] for batch_data in batch_list]),
+            model.r_steps: np.stack([batch_data['r_batch'] for batch_data in batch_list]),
+            model.pos_t_steps: np.stack([batch_data['pos_t_batch'] for batch_data in batch_list]),
+            model.neg_t_steps: np.stack([batch_data['neg_t_batch'] for batch_data in batch_list])
+        }
         return feed_dict
 
-    def generate_train_kg_feed_dict(self, model: GNN, batch_data: dict) -> dict:
+    def generate_train_kg_feed_dict(self, model: 'GNN', batch_data: dict) -> dict:
         """Generating feed dict for kg embedding training
         """
         feed_dict = {
@@ -318,7 +578,7 @@ class GnnLoader(DataBase):
         }
         return feed_dict
 
-    def generate_test_val_feed_dict(self, model: GNN, batch_data: dict)-> dict:
+    def generate_test_val_feed_dict(self, model: 'GNN', batch_data: dict)-> dict:
         """Generating testing and validating feed dict.
         """
         feed_dict = {
@@ -353,7 +613,7 @@ class GnnLoader(DataBase):
         return threat_data
 
     @staticmethod
-    def generate_test_threat_feed_dict(model: GNN, threat_data: dict) -> dict:
+    def generate_test_threat_feed_dict(model: 'GNN', threat_data: dict) -> dict:
         """For evaluation: generating treat data feed dict.
         """
         feed_dict = {
@@ -11,6 +11,15 @@ def ensureDir(dir_path: str) -> None:
     if not os.path.exists(dir):
         os.makedirs(dir)
 
+def get_weight_path(out_path: str, args) -> str:
+    """Getting checkpoint path of model weights under out_path for model settings in args.
+    """
+    layer = '-'.join([str(l) for l in eval(args.layer_size)])
+    regs = '-'.join([str(r) for r in eval(args.regs)])
+
+    return '%s/%s/%s/weight/%s/_l%s/_r%s/model.weights' % \
+           (out_path, args.model_type, args.embedding_type, args.lr, layer, regs)
+
 def printCooMatList(mat_list: list) -> None:
     """Printing content of CooMatList for debugging.
     """
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class MetaData(object):
     """Meta data of audit-based recommendation system.
 
@@ -9,14 +12,13 @@ class MetaData(object):
         n_relation: An integer indicating the number of relation types (e.g., read and location)
         n_triple: An integer indicating the number of edges in knowledge graph.
         n_entity_attr: An integer indicating the number of nodes in knowledge graph.
-        A_in: A list storing the knowledge-aware attention matrix.
-        all_h_list, all_t_list, all_r_list, all_v_list: lists representing triples of knowledge graph (head, tail, relation, value).
+        all_h_list, all_t_list, all_r_list, all_v_list: arrays representing triples of knowledge graph (head, tail, relation, value).
     """
-    def __init__(self, dataset: str) -> None:
-        """Init class MetaData with dataset.
+    def __init__(self, dataset: str, in_path: str = None, out_path: str = None) -> None:
+        """Init class MetaData with dataset (or explicit encoding and embedding paths).
         """
-        self.in_path = '../data/encoding/' + dataset
-        self.out_path = '../data/embedding/' + dataset
+        self.in_path = in_path if in_path else '../data/encoding/' + dataset
+        self.out_path = out_path if out_path else '../data/embedding/' + dataset
 
         self.n_entity = 0
         self.n_attr = 0
@@ -24,9 +26,7 @@ class MetaData(object):
         self.n_triple = 0
         self.n_entity_attr = 0
 
-        self.A_in = []
-
-        self.all_h_list = []
-        self.all_t_list = []
-        self.all_r_list = []
-        self.all_v_list = []
+        self.all_h_list = np.zeros(0, dtype=np.int64)
+        self.all_t_list = np.zeros(0, dtype=np.int64)
+        self.all_r_list = np.zeros(0, dtype=np.int64)
+        self.all_v_list = np.zeros(0, dtype=np.float32)
@@ -1,10 +1,14 @@
+from typing import TYPE_CHECKING
+
 import numpy as np
-import tensorflow as tf
 
-from model.GNN import GNN
-from util.gnn_data import GnnLoader
 from util.setting import logger
 
+if TYPE_CHECKING:
+    import tensorflow as tf
+    from model.GNN import GNN
+    from util.gnn_data import GnnLoader
+
 
 def early_stopping(rel_fn: int, best_fn: int, stopping_step: int, flag_step: int) -> tuple:
     """Judge whether stop model training early. 
@@ -23,16 +27,17 @@ def early_stopping(rel_fn: int, best_fn: int, stopping_step: int, flag_step: int
 
     return best_fn, stopping_step, should_stop
 
-def validation(sess: tf.Session, model: GNN, data_generator: GnnLoader, threshold: float) -> dict:
+def validation(sess: 'tf.Session', model: 'GNN', data_generator: 'GnnLoader', threshold: float) -> dict:
     """Validating recommendation model with validating data.
     """
     # benign data (Note: positives are predicted as cyber threats)
     tn_b, fp_b = 0, 0
+
+    # propagate once per evaluation pass, then batches are pure lookups and dot products
+    ea_embedding = model.eval_embedding(sess, data_generator.generate_eval_subgraphs())
     for i_batch in range(data_generator.n_batch_val):
         batch_data = data_generator.generate_val_batch(i_batch)
-        feed_dict = data_generator.generate_test_val_feed_dict(model, batch_data)
-        batch_rel = model.eval(sess, feed_dict=feed_dict)
-        batch_rel = np.diag(batch_rel)
+        batch_rel = model.score_pairs(ea_embedding, batch_data['e_batch'], batch_data['neg_e_batch'])
 
         # our validation set does not include positive (malicious) samples,
         # so that the prediction result is either true negative or false positive
@@ -46,16 +51,17 @@ def validation(sess: tf.Session, model: GNN, data_generator: GnnLoader, threshol
 
     return rel_stat
 
-def test(sess: tf.Session, model: GNN, data_generator: GnnLoader, threshold: float) -> dict:
+def test(sess: 'tf.Session', model: 'GNN', data_generator: 'GnnLoader', threshold: float) -> dict:
     """Evaluating recommendation model with testing data.
     """
     # benign data (Note: positives are predicted as cyber threats)
     tn_b, fp_b = 0, 0
+
+    # propagate once per evaluation pass, then batches are pure lookups and dot products
+    ea_embedding = model.eval_embedding(sess, data_generator.generate_eval_subgraphs())
     for i_batch in range(data_generator.n_batch_test):
         batch_data = data_generator.generate_test_batch(i_batch)
-        feed_dict = data_generator.generate_test_val_feed_dict(model, batch_data)
-        batch_rel = model.eval(sess, feed_dict=feed_dict)
-        batch_rel = np.diag(batch_rel)
+        batch_rel = model.score_pairs(ea_embedding, batch_data['e_batch'], batch_data['neg_e_batch'])
 
         # our test set (in this implementation) does not include positive (malicious) samples,
         # so that the prediction result is either true negative or false positive
@@ -69,7 +75,7 @@ def test(sess: tf.Session, model: GNN, data_generator: GnnLoader, threshold: flo
 
     return rel_stat
 
-def pred_inter(sess: tf.Session, model: GNN, inters: list) -> np.ndarray:
+def pred_inter(sess: 'tf.Session', model: 'GNN', inters: list) -> np.ndarray:
     """Predicting recommendation score for interactions
     
     Example: [[1,2], [1,3], [1,4]]
@@ -91,6 +97,5 @@ def pred_inter(sess: tf.Session, model: GNN, inters: list) -> np.ndarray:
     }
 
     inter_rel = model.eval(sess, feed_dict=feed_dict)
-    inter_rel = np.diag(inter_rel)
 
     return inter_rel
@@ -0,0 +1,108 @@
+import multiprocessing as mp
+import queue
+import random as rd
+import traceback
+
+import numpy as np
+
+from util.setting import logger
+
+
+class BatchPrefetcher(object):
+    """Iterator over training batches generated by a pool of worker processes.
+
+    Every worker seeds its own random streams from (seed, worker id) and writes batches into
+    its own preallocated int64 buffer slots in shared memory; only slot ids travel through
+    queues, which are bounded by the number of slots. Batches are handed back round-robin
+    over workers, so that the batch sequence is deterministic for a given seed and number
+    of workers. A worker failing (or killed) raises RuntimeError in the consumer instead of
+    blocking it.
+
+    Attributes:
+        batch_sizes: A dict mapping batch field names to their (fixed) lengths.
+        n_worker: An integer indicating the number of worker processes.
+    """
+    def __init__(self, generate_batch, batch_sizes: dict, n_worker: int, seed: int, n_slot_per_worker: int = 2) -> None:
+        """Init BatchPrefetcher class and start workers calling generate_batch.
+        """
+        self.batch_sizes = batch_sizes
+        self.n_worker = n_worker
+        self.i_batch = 0
+
+        # workers are forked, so that they share the (read-only) dataset of generate_batch
+        ctx = mp.get_context('fork')
+        n_slot = n_worker * n_slot_per_worker
+        self.buffers = [{name: np.frombuffer(ctx.RawArray('q', size), dtype=np.int64) for name, size in batch_sizes.items()}
+                        for _ in range(n_slot)]
+
+        # every worker owns n_slot_per_worker slots, which are handed back in order
+        self.free_queues = [ctx.Queue() for _ in range(n_worker)]
+        for slot in range(n_slot):
+            self.free_queues[slot // n_slot_per_worker].put(slot)
+        self.ready_queues = [ctx.Queue() for _ in range(n_worker)]
+
+        self.workers = [ctx.Process(target=self._work, args=(generate_batch, seed, worker), daemon=True)
+                        for worker in range(n_worker)]
+        for worker in self.workers:
+            worker.start()
+        logger.debug('start prefetching batches with {} workers'.format(n_worker))
+
+    def _work(self, generate_batch, seed: int, worker: int) -> None:
+        """Generating batches into free slots forever (or until generate_batch fails).
+
+        A failure is handed to the consumer as its traceback in place of a slot id.
+        """
+        np.random.seed([seed, worker])
+        rd.seed(int(np.random.randint(1 << 31)))
+
+        try:
+            while True:
+                batch_data = generate_batch()
+                slot = self.free_queues[worker].get()
+                for name, buffer in self.buffers[slot].items():
+                    buffer[:] = batch_data[name]
+                self.ready_queues[worker].put(slot)
+        except Exception:
+            self.ready_queues[worker].put(traceback.format_exc())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        """Taking the next batch (copied out of shared memory) in round-robin order of workers.
+        """
+        worker = self.i_batch % self.n_worker
+        slot = self._get_slot(worker)
+        self.i_batch += 1
+
+        batch_data = {name: buffer.copy() for name, buffer in self.buffers[slot].items()}
+        self.free_queues[worker].put(slot)
+
+        return batch_data
+
+    def _get_slot(self, worker: int, poll_interval: float = 1.) -> int:
+        """Waiting for the next ready slot of worker, raising RuntimeError if the worker failed or died.
+        """
+        while True:
+            # a worker found dead before waiting has flushed its last slot (or traceback)
+            alive = self.workers[worker].is_alive()
+            try:
+                slot = self.ready_queues[worker].get(timeout=poll_interval)
+                break
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError('prefetching worker {} exited with code {}'.format(
+                        worker, self.workers[worker].exitcode)) from None
+
+        if isinstance(slot, str):
+            raise RuntimeError('prefetching worker {} failed:\n{}'.format(worker, slot))
+
+        return slot
+
+    def close(self) -> None:
+        """Stopping workers.
+        """
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
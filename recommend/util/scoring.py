@@ -0,0 +1,243 @@
+import argparse
+import glob
+import os
+import sys
+import threading
+from time import time
+
+import numpy as np
+import tensorflow as tf
+
+from model.GNN import GNN
+from util.base_data import DataBase
+from util.data_loader import load_data_engine
+from util.helper import get_weight_path
+from util.meta_data import MetaData
+from util.model_eval import test
+from util.setting import logger
+
+
+class ModelScorer(object):
+    """Trained GNN model kept resident to score encoded graphs.
+
+    The tensorflow graph is built and the checkpoint restored once from the model directory
+    (encodings and weights of shadewatcher_train.py); scoring a dataset only preprocesses its
+    encodings and loads its kg triples into the graph data variables of the model.
+
+    Attributes:
+        model: A GNN model restored from the checkpoint.
+        sess: A tf.Session holding the restored weights.
+    """
+    def __init__(self, args: argparse.Namespace) -> None:
+        """Init ModelScorer class with args (model_path is the trained model directory).
+
+        Raises ValueError without model_path and FileNotFoundError without checkpoint.
+        """
+        # scoring never trains, so that the model is built for inference only
+        args = argparse.Namespace(**vars(args))
+        args.inference = True
+        self.args = args
+        if not args.model_path:
+            raise ValueError('scoring requires the trained model directory (--model_path)')
+
+        # the model is built from the dimensions of its encodings, without preprocessing them
+        meta_data = MetaData(args.dataset, in_path=args.model_path, out_path=args.model_path)
+        meta_data.n_entity, meta_data.n_attr, meta_data.n_relation, meta_data.n_triple = \
+            DataBase.read_kg_stat(args.model_path)
+        meta_data.n_entity_attr = meta_data.n_entity + meta_data.n_attr
+        self.model = GNN(args=args, meta_data=meta_data)
+
+        tf_config = tf.ConfigProto()
+        tf_config.gpu_options.allow_growth = True
+        self.sess = tf.Session(config=tf_config)
+        self.sess.run(tf.global_variables_initializer())
+
+        checkpoint_dir = os.path.dirname(get_weight_path(meta_data.out_path, args))
+        ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+        if not ckpt or not ckpt.all_model_checkpoint_paths:
+            raise FileNotFoundError('no checkpoint found in path: {}'.format(checkpoint_dir))
+        tf.train.Saver().restore(self.sess, ckpt.all_model_checkpoint_paths[0])
+        logger.info('scoring with model: {}'.format(ckpt.all_model_checkpoint_paths[0]))
+
+        # graph data variables hold one dataset at a time
+        self.lock = threading.Lock()
+
+    def load_dataset(self, dataset_path: str) -> tuple:
+        """Preprocessing encodings in dataset_path into a data generator and meta data.
+        """
+        args = argparse.Namespace(**vars(self.args))
+        args.dataset_path = dataset_path
+
+        meta_data = MetaData(args.dataset, in_path=dataset_path)
+        data_generator = load_data_engine(args, meta_data)
+        if meta_data.n_entity_attr != self.model.n_entity_attr:
+            raise ValueError('dataset has %d entities but the model has %d (pad entity2id.txt)' %
+                             (meta_data.n_entity_attr, self.model.n_entity_attr))
+
+        return data_generator, meta_data
+
+    def score(self, dataset_path: str, threshold: float = None, inters: list = None, with_scores: bool = False) -> dict:
+        """Scoring the testing interactions of dataset_path (or inters) on the dataset graph.
+
+        Returns tn_b/fp_b counts as driver.py reports them, and (e_id, neg_id, score)
+        rows of every interaction if with_scores is set.
+        """
+        threshold = self.args.threshold if threshold is None else threshold
+        data_generator, meta_data = self.load_dataset(dataset_path)
+
+        with self.lock:
+            self.model.load_graph_data(self.sess, meta_data)
+            if self.args.no_att == False:
+                self.model.update_attentive_A(self.sess)
+
+            if inters is None and not with_scores:
+                rel_stat = test(self.sess, self.model, data_generator, threshold)
+                return {metrics: int(value) for metrics, value in rel_stat.items()}
+
+            ea_embedding = self.model.eval_embedding(self.sess, data_generator.generate_eval_subgraphs())
+
+        if inters is None:
+            inters = np.stack((data_generator.inter_test_e, data_generator.inter_test_neg), axis=1)
+        inters = np.asarray(inters, dtype=np.int64).reshape(-1, 2)
+        scores = self.model.score_pairs(ea_embedding, inters[:, 0], inters[:, 1])
+
+        # positives are predicted as cyber threats
+        prediction = scores < threshold
+        rel_stat = {'tn_b': int(np.sum(prediction)), 'fp_b': int(prediction.size - np.sum(prediction))}
+        if with_scores:
+            rel_stat['scores'] = [[int(e), int(neg), float(score)] for (e, neg), score in zip(inters, scores)]
+
+        return rel_stat
+
+    def score_batch(self, dataset_paths: list, threshold: float = None) -> dict:
+        """Scoring the testing interactions of many datasets with a single propagation.
+
+        Datasets are merged into one block-diagonal graph (see merge_graphs) and scores are
+        split back per dataset; datasets failing to load are logged and skipped. Returns
+        tn_b/fp_b counts of every scored dataset path.
+        """
+        threshold = self.args.threshold if threshold is None else threshold
+
+        graphs = []
+        for dataset_path in dataset_paths:
+            try:
+                data_generator, meta_data = self.load_dataset(dataset_path)
+            except Exception as e:
+                logger.error('failed to score {}: {}'.format(dataset_path, e))
+                continue
+            graphs.append((dataset_path, data_generator, meta_data))
+        if not graphs:
+            return {}
+
+        subgraph, triples, graph_index = merge_graphs(graphs)
+
+        with self.lock:
+            if self.args.no_att == False:
+                # attention is refreshed once over the merged triples: heads are normalized
+                # by their merged local rows, which never mix across graphs (fold bounds of the
+                # unsorted merged heads are unused, since propagation reads the subgraph feeds)
+                self.model._load_triples(self.sess, *triples)
+                subgraph['sub_values'] = self.sess.run(self.model.A_out.values,
+                                                       feed_dict={self.model.A_rows: subgraph['sub_indices']})
+
+            ea_embedding = self.model.eval_sub_embedding(self.sess, subgraph)
+
+        rel_stats = {}
+        for dataset_path, inters in graph_index.items():
+            scores = self.model.score_pairs(ea_embedding, inters[:, 0], inters[:, 1])
+
+            # positives are predicted as cyber threats
+            prediction = scores < threshold
+            rel_stats[dataset_path] = {'tn_b': int(np.sum(prediction)), 'fp_b': int(prediction.size - np.sum(prediction))}
+
+        return rel_stats
+
+
+def merge_graphs(graphs: list) -> tuple:
+    """Merging (dataset path, data generator, meta data) graphs into one block-diagonal subgraph.
+
+    Only nodes of kg triples and testing interactions join the block of a graph, and node ids
+    of a block are offset by the number of nodes of the blocks before it. Rows of different
+    blocks never mix, so that propagated embeddings (and attention normalized per row) are
+    those of every graph alone.
+
+    Returns the subgraph feeds (see GNN.eval_sub_embedding) with the adjacency values as edge
+    values, the merged (head, tail, relation, value) triples of global node ids in the order of
+    sub_indices, and an index mapping every dataset path to its testing interactions as (e, neg)
+    rows of merged node ids.
+    """
+    sub_nodes, sub_indices = [], []
+    graph_index = {}
+    n_node = 0
+    for (dataset_path, data_generator, meta_data) in graphs:
+        inters = np.stack((data_generator.inter_test_e, data_generator.inter_test_neg), axis=1)
+        nodes = np.unique(np.concatenate((meta_data.all_h_list, meta_data.all_t_list, inters.ravel())))
+
+        sub_nodes.append(nodes)
+        sub_indices.append(np.stack((np.searchsorted(nodes, meta_data.all_h_list),
+                                     np.searchsorted(nodes, meta_data.all_t_list)), axis=1) + n_node)
+        graph_index[dataset_path] = np.searchsorted(nodes, inters) + n_node
+        n_node += len(nodes)
+
+    triples = tuple(np.concatenate([getattr(meta_data, name) for _, _, meta_data in graphs])
+                    for name in ['all_h_list', 'all_t_list', 'all_r_list', 'all_v_list'])
+
+    subgraph = {}
+    subgraph['sub_nodes'] = np.concatenate(sub_nodes)
+    subgraph['sub_indices'] = np.concatenate(sub_indices)
+    subgraph['sub_values'] = triples[3].astype(np.float32)
+
+    return subgraph, triples, graph_index
+
+
+def score_datasets(args: argparse.Namespace) -> None:
+    """Scoring every encoding directory matching args.datasets with the model restored once.
+
+    Writes a `dataset,tn_b,fp_b` row per dataset to args.result_path (or stdout); datasets
+    failing to load are logged and skipped. With args.batch_graphs > 1, batches of datasets
+    are propagated at once (see ModelScorer.score_batch).
+    """
+    dataset_paths = sorted(set(sum((glob.glob(pattern) for pattern in args.datasets), [])))
+    if not dataset_paths:
+        logger.error('no dataset matches: {}'.format(' '.join(args.datasets)))
+        exit(-1)
+
+    try:
+        scorer = ModelScorer(args)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(str(e))
+        exit(-1)
+
+    result_file = sys.stdout
+    if args.result_path:
+        new_file = not os.path.exists(args.result_path)
+        result_file = open(args.result_path, 'a')
+        if new_file:
+            print('dataset,tn_b,fp_b', file=result_file)
+
+    batch_graphs = max(args.batch_graphs, 1)
+    n_fail = 0
+    try:
+        for i_batch in range(0, len(dataset_paths), batch_graphs):
+            t1 = time()
+            batch_paths = dataset_paths[i_batch:i_batch + batch_graphs]
+            if batch_graphs > 1:
+                rel_stats = scorer.score_batch(batch_paths)
+            else:
+                rel_stats = {}
+                try:
+                    rel_stats[batch_paths[0]] = scorer.score(batch_paths[0])
+                except Exception as e:
+                    logger.error('failed to score {}: {}'.format(batch_paths[0], e))
+
+            n_fail += len(batch_paths) - len(rel_stats)
+            for dataset_path, rel_stat in rel_stats.items():
+                print('%s,%d,%d' % (dataset_path, rel_stat['tn_b'], rel_stat['fp_b']), file=result_file)
+                logger.info('%s: tn_b: %d, fp_b: %d' % (dataset_path, rel_stat['tn_b'], rel_stat['fp_b']))
+            result_file.flush()
+            logger.info('scored {} datasets [{:.1f}s]'.format(len(rel_stats), time() - t1))
+    finally:
+        if result_file is not sys.stdout:
+            result_file.close()
+
+    logger.info('scored {} datasets ({} failed)'.format(len(dataset_paths) - n_fail, n_fail))
@@ -0,0 +1,143 @@
+import argparse
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import time
+
+from util.scoring import ModelScorer
+from util.setting import logger
+
+
+class ScoringJob(object):
+    """Scoring request waiting in the service queue.
+    """
+    def __init__(self, request: dict) -> None:
+        self.request = request
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    """HTTP service scoring encoded datasets with a resident ModelScorer.
+
+    Endpoints:
+        POST /score: {"dataset_path": str, "threshold": float, "interactions": [[e, neg], ...], "scores": bool},
+            where only dataset_path is required; returns {"tn_b": int, "fp_b": int, "time": float}
+            and the (e, neg, score) rows if scores is set.
+        GET /health: {"status": "ok", "queued": int}.
+
+    Requests are queued (at most serve_queue_size, further requests are rejected with 503)
+    and processed by serve_workers threads.
+    """
+    daemon_threads = True
+
+    def __init__(self, args: argparse.Namespace, scorer: ModelScorer) -> None:
+        """Init ScoringServer class and start workers.
+        """
+        HTTPServer.__init__(self, (args.serve_host, args.serve_port), ScoringHandler)
+        self.scorer = scorer
+        self.jobs = queue.Queue(maxsize=args.serve_queue_size)
+
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max(args.serve_workers, 1))]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self) -> None:
+        """Processing queued jobs forever.
+        """
+        while True:
+            job = self.jobs.get()
+            try:
+                request = job.request
+                job.result = self.scorer.score(request['dataset_path'],
+                                               threshold=request.get('threshold'),
+                                               inters=request.get('interactions'),
+                                               with_scores=bool(request.get('scores', False)))
+            except Exception as e:
+                logger.error('failed to score {}: {}'.format(job.request.get('dataset_path'), e))
+                job.error = str(e)
+            job.done.set()
+
+    def submit(self, request: dict) -> ScoringJob:
+        """Queuing a scoring request, returning None if the queue is full.
+        """
+        job = ScoringJob(request)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            return None
+
+        return job
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """Request handler of ScoringServer.
+    """
+    def _reply(self, code: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if self.path != '/health':
+            self._reply(404, {'error': 'unknown path: {}'.format(self.path)})
+            return
+
+        self._reply(200, {'status': 'ok', 'queued': self.server.jobs.qsize()})
+
+    def do_POST(self) -> None:
+        if self.path != '/score':
+            self._reply(404, {'error': 'unknown path: {}'.format(self.path)})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode())
+            if not isinstance(request, dict) or 'dataset_path' not in request:
+                raise ValueError('dataset_path is required')
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+
+        t1 = time()
+        job = self.server.submit(request)
+        if job is None:
+            self._reply(503, {'error': 'scoring queue is full'})
+            return
+
+        job.done.wait()
+        if job.error is not None:
+            self._reply(500, {'error': job.error})
+            return
+
+        result = dict(job.result)
+        result['time'] = time() - t1
+        self._reply(200, result)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug('%s - %s' % (self.address_string(), format % args))
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Restoring the model of args.model_path and serving scoring requests until interrupted.
+    """
+    try:
+        scorer = ModelScorer(args)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(str(e))
+        exit(-1)
+    server = ScoringServer(args, scorer)
+    logger.info('scoring service listening on {}:{}'.format(args.serve_host, args.serve_port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('scoring service stopped')
+    finally:
+        server.server_close()
@@ -1,13 +1,13 @@
 import argparse
 import logging
 
-from colorlog import ColoredFormatter
-
 logger = logging.getLogger(name=__name__)
 
 def init_logger(level: int) -> None:
     """Set logger level indicating which logging statements printed while programs running.
     """
+    from colorlog import ColoredFormatter
+
     formatter = ColoredFormatter(
         "%(white)s%(asctime)10s | %(log_color)s%(levelname)6s | %(log_color)s%(message)6s",
         reset=True,
@@ -25,8 +25,8 @@ def init_logger(level: int) -> None:
     logger.addHandler(handler)
     logger.setLevel(level)
 
-def parse_args() -> argparse.Namespace:
-    """Parse user input and configuration setting.
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parse user input (or argv) and configuration setting.
     """
     parser = argparse.ArgumentParser(prog="driver" ,
                                      description="recommendation system")
@@ -40,12 +40,22 @@ def parse_args() -> argparse.Namespace:
     # setting for dataset
     parser.add_argument('--dataset', type=str, default='test',
                         help='Dir to store encoding dataset.')
+    parser.add_argument('--dataset_path', type=str, default=None,
+                        help='encoding directory of the dataset (default: ../data/encoding/<dataset>)')
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='directory of a trained model (encodings and weights) for scoring')
     parser.add_argument('--ignore_inter', nargs='?', default='[]',
                         help='Ignore system entity interactions in [3,4,132] file.')
     parser.add_argument('--inter_pos_rate', type=int, default=2,
                         help='ratio of positive and negative entities in interactions')
     parser.add_argument('--triple_pos_rate', type=int, default=2,
                         help='ratio of positive and negative entities in embedding')
+    parser.add_argument('--seed', type=int, default=2021,
+                        help='Random seed for dataset splitting and training (default: 2021)')
+    parser.add_argument('--no_cache', default=False, action='store_true',
+                        help='whether disable the on-disk preprocessed dataset cache.')
+    parser.add_argument('--cache_entries', type=int, default=2,
+                        help='maximum number of cached preprocessings kept per dataset (least recently used are evicted)')
 
     # setting for model
     parser.add_argument('--pretrain', type=int, default=0,
@@ -56,6 +66,12 @@ def parse_args() -> argparse.Namespace:
                         help='type of learning model from {gnn}')
     parser.add_argument('--adj_type', type=str, default='si',
                         help='type of adjacency (norm) matrix from {bi, si}')
+    parser.add_argument('--n_fold', type=int, default=0,
+                        help='number of row folds of adjacency in propagation (0: chosen from propagation_memory_mb)')
+    parser.add_argument('--att_memory_mb', type=int, default=256,
+                        help='memory budget (MB) of scoring a fold of kg triples in attention refresh (0: unlimited)')
+    parser.add_argument('--propagation_memory_mb', type=int, default=0,
+                        help='memory budget (MB) of propagating a single fold of adjacency (0: unlimited)')
 
     # setting for training
     parser.add_argument('--test_size', type=float, default=0.1,
@@ -74,7 +90,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('--regs', nargs='?', default='[1e-5,1e-5]',
                         help='Regularization for user and item embeddings.')
     parser.add_argument('--opt_type', type=str, default='Adam',
-                        help='type of training optimizer from {Adam, SGD, AdaDelta}')
+                        help='type of training optimizer from {Adam, LazyAdam, Adagrad, SGD, AdaDelta}')
     parser.add_argument('--mess_dropout', nargs='?', default='[0.2,0.2,0.2]',
                         help='drop probability')
 
@@ -84,6 +100,8 @@ def parse_args() -> argparse.Namespace:
                         help='whether using knowledge graph embedding.')
     parser.add_argument('--no_att', default=False, action='store_true',
                         help='whether using attention mechanism.')
+    parser.add_argument('--att_refresh_every', type=int, default=0,
+                        help='refresh knowledge-aware attention every N epochs (default: 0 - only before training)')
 
     parser.add_argument('--show_test', default=False, action='store_true',
                         help='show test results')
@@ -108,10 +126,50 @@ def parse_args() -> argparse.Namespace:
     # setting for gnn
     parser.add_argument('--batch_size_gnn', type=int, default=1024,
                         help='Gnn batch size')
+    parser.add_argument('--batch_size_eval', type=int, default=16384,
+                        help='Testing and validating batch size')
+    parser.add_argument('--recompute', default=False, action='store_true',
+                        help='recompute gnn layer activations in backward pass instead of storing them')
+    parser.add_argument('--in_graph_sampling', default=False, action='store_true',
+                        help='sample training batches in graph with tf.data (full sampling, single step per run only)')
+    parser.add_argument('--n_parallel_sampling', type=int, default=4,
+                        help='number of parallel sampling calls (and prefetched batches) of in-graph sampling')
+    parser.add_argument('--n_workers', type=int, default=0,
+                        help='number of background processes prefetching training batches (0: sample in the trainer)')
+    parser.add_argument('--steps_per_run', type=int, default=1,
+                        help='number of training steps (batches) run by a single session call (full sampling, no in-graph sampling)')
     parser.add_argument('--layer_size', nargs='?', default='[32,16]',
                         help='embedding size of every layer (changed with mess_dropout)')
     parser.add_argument('--agg_type', nargs='?', default='graphsage',
                         help='Specify the type of gnn aggregation from {bi, gcn, graphsage}.')
+    parser.add_argument('--sampling', type=str, default='full',
+                        help='type of gnn training propagation from {full, neighbor, cluster}')
+    parser.add_argument('--fanouts', nargs='?', default='[10,10]',
+                        help='number of sampled neighbors per hop for neighbor sampling (changed with layer_size)')
+    parser.add_argument('--n_cluster', type=int, default=50,
+                        help='number of graph partitions for cluster sampling')
+    parser.add_argument('--cluster_per_batch', type=int, default=2,
+                        help='number of partitions merged into every training batch for cluster sampling')
+
+    # setting for scoring trained models
+    parser.add_argument('--inference', default=False, action='store_true',
+                        help='build only propagation and scoring without training machinery (requires --epoch 0)')
+    parser.add_argument('--datasets', nargs='+', default=None,
+                        help='glob paths of encoding directories scored one by one with the model of model_path')
+    parser.add_argument('--result_path', type=str, default=None,
+                        help='csv file to append dataset results to (default: stdout)')
+    parser.add_argument('--batch_graphs', type=int, default=1,
+                        help='number of datasets merged into one block-diagonal graph and propagated at once')
+    parser.add_argument('--serve', default=False, action='store_true',
+                        help='keep the model of model_path resident and score datasets over http')
+    parser.add_argument('--serve_host', type=str, default='127.0.0.1',
+                        help='host address of the scoring service')
+    parser.add_argument('--serve_port', type=int, default=8470,
+                        help='port of the scoring service')
+    parser.add_argument('--serve_workers', type=int, default=2,
+                        help='number of requests processed concurrently by the scoring service')
+    parser.add_argument('--serve_queue_size', type=int, default=16,
+                        help='number of requests waiting in the scoring service queue before rejecting')
 
     # advanced option
     parser.add_argument('--train_kg', default=False, action='store_true',
@@ -121,7 +179,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('--save_embedding', default=False, action='store_true',
                         help='save kg embedding from weights')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # init arguments
     if args.train_kg:
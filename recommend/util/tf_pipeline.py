@@ -0,0 +1,174 @@
+import argparse
+
+import tensorflow as tf
+
+from util.meta_data import MetaData
+
+
+class TrainPipeline(object):
+    """In-graph sampling of training batches with tf.data.
+
+    Mirrors GnnLoader._generate_train_inter_batch and _generate_train_kg_batch with tf ops:
+    CSR indices of interactions and kg triples are fed once into initializable iterators,
+    batches are sampled by parallel map calls (outside the Python GIL) and prefetched, so
+    that sampling overlaps with training steps.
+
+    Attributes:
+        inter_batch: A tuple of (e, pos_e, neg_e) tensors yielding a new batch per evaluation.
+        kg_batch: A tuple of (h, r, pos_t, neg_t) tensors yielding a new batch per evaluation.
+    """
+    def __init__(self, args: argparse.Namespace, meta_data: MetaData) -> None:
+        """Init TrainPipeline class with batch settings in args and entity counts in meta_data.
+        """
+        self.batch_size_gnn = args.batch_size_gnn
+        self.batch_size_kg = args.batch_size_kg
+        self.inter_pos_rate = args.inter_pos_rate
+        self.triple_pos_rate = args.triple_pos_rate
+        self.n_entity = meta_data.n_entity
+        self.n_entity_attr = meta_data.n_entity_attr
+        self.n_parallel = max(args.n_parallel_sampling, 1)
+
+        self._build_inputs()
+        self.inter_iterator, self.inter_batch = self._build_iterator(self._sample_inter_batch)
+        self.kg_iterator, self.kg_batch = self._build_iterator(self._sample_kg_batch)
+
+    def _build_inputs(self) -> None:
+        """Building placeholders of CSR indices (fed when iterators are initialized).
+        """
+        self.exist_entity = tf.placeholder(tf.int64, shape=[None], name='pipeline_exist_entity')
+        self.inter_indptr = tf.placeholder(tf.int64, shape=[None], name='pipeline_inter_indptr')
+        self.inter_indices = tf.placeholder(tf.int64, shape=[None], name='pipeline_inter_indices')
+        self.inter_keys = tf.placeholder(tf.int64, shape=[None], name='pipeline_inter_keys')
+
+        self.exist_head = tf.placeholder(tf.int64, shape=[None], name='pipeline_exist_head')
+        self.kg_indptr = tf.placeholder(tf.int64, shape=[None], name='pipeline_kg_indptr')
+        self.kg_tails = tf.placeholder(tf.int64, shape=[None], name='pipeline_kg_tails')
+        self.kg_relations = tf.placeholder(tf.int64, shape=[None], name='pipeline_kg_relations')
+        self.kg_keys = tf.placeholder(tf.int64, shape=[None], name='pipeline_kg_keys')
+        self.n_kg_relation = tf.placeholder(tf.int64, shape=[], name='pipeline_n_kg_relation')
+
+    def _build_iterator(self, sample_batch) -> tuple:
+        """Building an initializable iterator over endless batches of sample_batch.
+        """
+        dataset = tf.data.Dataset.range(1).repeat()
+        dataset = dataset.map(lambda _: sample_batch(), num_parallel_calls=self.n_parallel)
+        dataset = dataset.prefetch(self.n_parallel)
+        iterator = dataset.make_initializable_iterator()
+
+        return iterator, iterator.get_next()
+
+    def initialize(self, sess: tf.Session, data_generator) -> None:
+        """Feeding CSR indices of data_generator (GnnLoader) into the iterators.
+        """
+        sess.run([self.inter_iterator.initializer, self.kg_iterator.initializer], feed_dict={
+            self.exist_entity: data_generator.exist_entity,
+            self.inter_indptr: data_generator.inter_indptr,
+            self.inter_indices: data_generator.inter_indices,
+            self.inter_keys: data_generator.inter_keys,
+            self.exist_head: data_generator.exist_head,
+            self.kg_indptr: data_generator.kg_indptr,
+            self.kg_tails: data_generator.kg_tails,
+            self.kg_relations: data_generator.kg_relations,
+            self.kg_keys: data_generator.kg_keys,
+            self.n_kg_relation: data_generator.n_kg_relation
+        })
+
+    def _sample_inter_batch(self) -> tuple:
+        """Sampling a batch of (system entity, positives, negatives) as GnnLoader does.
+        """
+        e_batch = self._sample_rows(self.exist_entity, self.batch_size_gnn)
+
+        # negatives: one interacted entity per system entity
+        neg_batch = tf.gather(self.inter_indices, self._sample_in_rows(self.inter_indptr, e_batch))
+
+        # positives: inter_pos_rate distinct entities without interactions per system entity
+        pos_batch = self._sample_exclusive_batch(self.inter_keys, e_batch * (1 << 32), 1, self.inter_pos_rate)
+
+        return e_batch, pos_batch, neg_batch
+
+    def _sample_kg_batch(self) -> tuple:
+        """Sampling a batch of (head, relation, positive tails, negative tail) as GnnLoader does.
+        """
+        h_batch = self._sample_rows(self.exist_head, self.batch_size_kg)
+
+        # negatives: one existing (tail, relation) per head
+        neg_id = self._sample_in_rows(self.kg_indptr, h_batch)
+        r_batch = tf.gather(self.kg_relations, neg_id)
+        neg_t_batch = tf.gather(self.kg_tails, neg_id)
+
+        # positives: triple_pos_rate distinct tails that do not form (head, tail, relation) triples
+        key_base = h_batch * self.n_entity_attr * self.n_kg_relation + r_batch
+        pos_t_batch = self._sample_exclusive_batch(self.kg_keys, key_base, self.n_kg_relation, self.triple_pos_rate)
+
+        return h_batch, r_batch, pos_t_batch, neg_t_batch
+
+    @staticmethod
+    def _sample_rows(rows: tf.Tensor, batch_size: int) -> tf.Tensor:
+        """Sampling batch_size rows, without replacement if there are enough rows.
+
+        Distinct ids are drawn with replacement and deduplicated (keeping first occurrences)
+        until batch_size of them are found, so that a step costs O(batch_size) instead of
+        shuffling all rows.
+        """
+        n_row = tf.shape(rows, out_type=tf.int64)[0]
+
+        def _distinct_ids():
+            def _cond(ids):
+                return tf.size(ids) < batch_size
+
+            def _body(ids):
+                draws = tf.random.uniform([2 * batch_size], maxval=n_row, dtype=tf.int64)
+                ids, _ = tf.unique(tf.concat([ids, draws], 0))
+                return ids[:batch_size]
+
+            return tf.while_loop(_cond, _body, [tf.zeros([0], dtype=tf.int64)],
+                                 shape_invariants=[tf.TensorShape([None])])
+
+        return tf.cond(batch_size <= n_row,
+                       lambda: tf.gather(rows, _distinct_ids()),
+                       lambda: tf.gather(rows, tf.random.uniform([batch_size], maxval=n_row, dtype=tf.int64)))
+
+    @staticmethod
+    def _sample_in_rows(indptr: tf.Tensor, rows: tf.Tensor) -> tf.Tensor:
+        """Sampling a uniform CSR entry of every row.
+        """
+        start = tf.gather(indptr, rows)
+        degree = tf.gather(indptr, rows + 1) - start
+        offset = tf.cast(tf.random.uniform(tf.shape(rows)) * tf.cast(degree, tf.float32), tf.int64)
+
+        return start + tf.minimum(offset, degree - 1)
+
+    def _sample_exclusive_batch(self, sorted_keys: tf.Tensor, key_base: tf.Tensor, key_stride, rate: int) -> tf.Tensor:
+        """Sampling `rate` distinct entities for every row of a batch with column-wise rejection.
+
+        Same as DataBase._sample_exclusive_batch: candidate c of row i is rejected if
+        key_base[i] + c * key_stride exists in sorted_keys or c has been sampled in row i.
+        """
+        n_key = tf.shape(sorted_keys, out_type=tf.int64)[0]
+        columns = []
+
+        for _ in range(rate):
+            def _cond(column, pending):
+                return tf.reduce_any(pending)
+
+            def _body(column, pending):
+                candidates = tf.random.uniform(tf.shape(key_base), maxval=self.n_entity, dtype=tf.int64)
+
+                # membership test against sorted packed keys
+                query = key_base + candidates * key_stride
+                pos = tf.minimum(tf.searchsorted(sorted_keys, query, out_type=tf.int64), tf.maximum(n_key - 1, 0))
+                rejected = tf.cond(n_key > 0,
+                                   lambda: tf.equal(tf.gather(sorted_keys, pos), query),
+                                   lambda: tf.zeros_like(pending))
+
+                # entities must be distinct within a row
+                for previous in columns:
+                    rejected = rejected | tf.equal(previous, candidates)
+
+                column = tf.where(pending, candidates, column)
+                return column, pending & rejected
+
+            column, _ = tf.while_loop(_cond, _body, [tf.zeros_like(key_base), tf.ones_like(key_base, dtype=tf.bool)])
+            columns.append(column)
+
+        return tf.reshape(tf.stack(columns, axis=1), [-1])
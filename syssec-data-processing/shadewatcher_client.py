@@ -0,0 +1,56 @@
+"""
+Client of the Shadewatcher scoring service, which keeps a trained model resident:
+
+    cd $SHADEWATCHER_DIR/recommend
+    python3.6 driver.py --serve --model_path <model> --test_size 0.99999 --val_size 0.0 --no_cache
+"""
+
+import json
+import urllib.error
+import urllib.request
+
+DEFAULT_SERVER = "http://127.0.0.1:8470"
+
+
+def score(server, dataset_path, threshold=None, interactions=None, scores=False, timeout=None):
+    """Score the encodings in dataset_path (a directory readable by the server)
+
+    Returns the response, e.g. {"tn_b": 55, "fp_b": 7, "time": 1.2}
+    """
+    request = {"dataset_path": dataset_path, "scores": scores}
+    if threshold is not None:
+        request["threshold"] = threshold
+    if interactions is not None:
+        request["interactions"] = interactions
+
+    http_request = urllib.request.Request(
+        f"{server}/score",
+        data=json.dumps(request).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except urllib.error.HTTPError as ex:
+        raise RuntimeError(f"{ex.code}: {ex.read().decode()}") from ex
+
+
+def health(server, timeout=None):
+    """Check whether the scoring service is up"""
+    with urllib.request.urlopen(f"{server}/health", timeout=timeout) as response:
+        return json.loads(response.read().decode())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_path", help="path to the test graph encodings")
+    parser.add_argument("--server", help="scoring service url", default=DEFAULT_SERVER)
+    parser.add_argument("--threshold", help="model evaulation threshold", type=float)
+    parser.add_argument(
+        "--scores", help="return the score of every interaction", action="store_true"
+    )
+    args = parser.parse_args()
+
+    print(json.dumps(score(args.server, args.dataset_path, args.threshold, scores=args.scores)))
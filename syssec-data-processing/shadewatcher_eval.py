@@ -9,6 +9,7 @@ import os
 
 from shadewatcher_common import *
 import encoding_parser
+import shadewatcher_client
 
 
 def pad_file(train_entity_path, test_entity_path):
@@ -31,6 +32,166 @@ def pad_file(train_entity_path, test_entity_path):
             print("\n".join(lines[1:]), file=entity_file)
 
 
+def run_driver(token, threshold):
+    """Run the gnn code on the encodings of token with the pretrained model of token:
+        - 0 epoch           no need to train the model on evaluation data
+        - 0.99999 test_size closest you can get to 1.0 to make
+                            Shadewatcher use 100% of the input data as validation data
+
+    Returns the (true negative, false positive) counts
+    """
+    test_output = subprocess.run(
+        [
+            "python3.6",
+            "driver.py",
+            "--dataset",
+            str(token),
+            "--epoch",
+            str(0),
+            "--show_val",
+            "--show_test",
+            "--threshold",
+            str(threshold),
+            "--pretrain",
+            str(2),
+            "--test_size",
+            str(0.99999),
+            "--val_size",
+            str(0.0),
+            "--no_cache",
+        ],
+        cwd=GNN_PATH,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+
+    # example lines from output:
+    #
+    # ...
+    # 2021-11-24 19:43:41,785 |   INFO | metrics: tn_b, value: 55
+    # 2021-11-24 19:43:41,785 |   INFO | metrics: fp_b, value: 7
+    try:
+        true_negative, false_positive = (
+            int(val[val.rindex(":") + 2 : val.rindex("\x1b")])
+            for val in test_output.stderr.decode().splitlines()[-2:]
+        )
+    except ValueError as ex:
+        raise RuntimeError(test_output.stderr.decode()) from ex
+
+    return true_negative, false_positive
+
+
+def prepare_encodings(test_path, encoding_path, model_path, randomize=False):
+    """Copy the encodings of a test instance into encoding_path, padded to the size of the model"""
+    subprocess.call(["rm", "-rf", encoding_path])
+    subprocess.call(["mkdir", "-p", encoding_path])
+    subprocess.call(["cp", "-R", f"{test_path}/.", encoding_path])
+
+    if randomize:  # reparse the encodings with the randomized flag
+        # run the one-hot encoder
+        encoding_parser.encode(
+            edgefile_path=f"{encoding_path}/{EDGEFACT_FILE}",
+            nodefile_path=f"{encoding_path}/{NODEFACT_FILE}",
+            output_path=encoding_path,
+            randomize_edges=True,
+        )
+
+    # pad the test instance to be the size of the model
+    pad_file(
+        train_entity_path=f"{model_path}/{ENTITY_FILE}",
+        test_entity_path=f"{encoding_path}/{ENTITY_FILE}",
+    )
+
+
+def write_result(output_file_path, test_path, true_negative, false_positive, benign):
+    """Append the result row of a test instance"""
+    if benign:
+        tn, fp, tp, fn = true_negative, false_positive, 0, 0
+    else:
+        tn, fp, tp, fn = 0, 0, false_positive, true_negative
+
+    print(f"[fp: {fp}] [tn: {tn}] [tp: {tp}] [fn: {fn}]", file=sys.stderr)
+
+    # save the results the a file
+    with open(output_file_path, "a", encoding="utf-8") as output_file:
+        print(
+            f"{stringify_path(test_path)},{tn},{fp},{tp},{fn}",
+            file=output_file,
+        )
+
+
+def evaluate_single_process(
+    test_paths, model_path, output_file_path, threshold, randomize, benign, token, batch_graphs=1
+):
+    """Run all test graphs through the model in a single gnn process, which restores the
+    model once and scores the graphs one by one (driver.py --datasets), or batch_graphs
+    graphs at a time merged into one graph (driver.py --batch_graphs)
+
+    Returns the number of graphs that failed to evaluate
+    """
+    graphs_path = os.path.abspath(f"{ENCODING_PATH}/{token}/graphs")
+    results_path = os.path.abspath(f"{ENCODING_PATH}/{token}/results.csv")
+
+    # the index of a graph directory maps its result back to the test instance
+    graph_paths = {}
+    for test_path in test_paths:
+        if not os.path.exists(test_path):
+            print(test_path, "is not a valid path.", file=sys.stderr)
+            continue  # skip past already converted graphs
+
+        graph_path = f"{graphs_path}/{len(graph_paths)}"
+        prepare_encodings(test_path, graph_path, model_path, randomize)
+        graph_paths[graph_path] = test_path
+
+    test_output = subprocess.run(
+        [
+            "python3.6",
+            "driver.py",
+            "--datasets",
+            f"{graphs_path}/*",
+            "--model_path",
+            os.path.abspath(model_path),
+            "--result_path",
+            results_path,
+            "--batch_graphs",
+            str(batch_graphs),
+            "--threshold",
+            str(threshold),
+            "--test_size",
+            str(0.99999),
+            "--val_size",
+            str(0.0),
+            "--no_cache",
+        ],
+        cwd=GNN_PATH,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+
+    results = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as results_file:
+            _, *lines = results_file.read().splitlines()
+        for line in lines:
+            graph_path, true_negative, false_positive = line.rsplit(",", 2)
+            results[graph_path] = int(true_negative), int(false_positive)
+
+    issue_count = 0
+    for graph_path, test_path in graph_paths.items():
+        print(f"{test_path} >> ", end="", file=sys.stderr)
+        if graph_path not in results:
+            if "LOG_ERR" in os.environ:
+                print("Error:", test_output.stderr.decode(), sep="\n", file=sys.stderr)
+            else:
+                print("fail...", file=sys.stderr)
+            issue_count += 1
+            continue
+
+        write_result(output_file_path, test_path, *results[graph_path], benign)
+
+    return issue_count
+
+
 def evaluate(
     test_paths,
     model_path,
@@ -39,20 +200,23 @@ def evaluate(
     randomize=False,
     benign=True,
     token=random.randrange(10000, 10000000),
+    server=None,
+    single_process=False,
+    batch_graphs=1,
 ):
     """Sequentially run each test graph through the model by copying the encodings into the
-    correct Shadewatcher directory and running the gnn code with parameter:
-        - 0 epoch           no need to train the model on evaluation data
-        - 0.99999 test_size closest you can get to 1.0 to make
-                            Shadewatcher use 100% of the input data as validation data
+    correct Shadewatcher directory and running the gnn code (see run_driver), sending
+    them to a scoring service that keeps the model resident (see shadewatcher_client.py),
+    or scoring all of them in one gnn process (see evaluate_single_process)
 
     To help differentiate these instances so that evaluations can be run in parallel,
     utilize a token in the filepaths within Shadewatcher
     """
-    # copy the model into the Shadewatcher embeddings directory
-    subprocess.call(["rm", "-rf", f"{EMBEDDING_PATH}/{token}"])
-    subprocess.call(["mkdir", "-p", f"{EMBEDDING_PATH}/{token}"])
-    subprocess.call(["cp", "-R", f"{model_path}/.", f"{EMBEDDING_PATH}/{token}"])
+    # copy the model into the Shadewatcher embeddings directory (otherwise read in place)
+    if server is None and not single_process:
+        subprocess.call(["rm", "-rf", f"{EMBEDDING_PATH}/{token}"])
+        subprocess.call(["mkdir", "-p", f"{EMBEDDING_PATH}/{token}"])
+        subprocess.call(["cp", "-R", f"{model_path}/.", f"{EMBEDDING_PATH}/{token}"])
 
     # write header to the file if it doesnt exists
     if not os.path.exists(output_file_path):
@@ -61,6 +225,12 @@ def evaluate(
 
     issue_count = 0
 
+    if single_process:
+        issue_count = evaluate_single_process(
+            test_paths, model_path, output_file_path, threshold, randomize, benign, token, batch_graphs
+        )
+        test_paths = []
+
     for test_path in test_paths:
         if not os.path.exists(test_path):
             print(test_path, "is not a valid path.", file=sys.stderr)
@@ -69,77 +239,22 @@ def evaluate(
         print(f"{test_path} >> ", end="", file=sys.stderr)
 
         # copy the encodings from the test instance into the Shadewatcher encodings directory
-        subprocess.call(["rm", "-rf", f"{ENCODING_PATH}/{token}"])
-        subprocess.call(["mkdir", "-p", f"{ENCODING_PATH}/{token}"])
-        subprocess.call(["cp", "-R", f"{test_path}/.", f"{ENCODING_PATH}/{token}"])
-
-        if randomize:  # reparse the encodings with the randomized flag
-            # run the one-hot encoder
-            encoding_parser.encode(
-                edgefile_path=f"{ENCODING_PATH}/{token}/{EDGEFACT_FILE}",
-                nodefile_path=f"{ENCODING_PATH}/{token}/{NODEFACT_FILE}",
-                output_path=f"{ENCODING_PATH}/{token}",
-                randomize_edges=True,
-            )
-
-        # pad the test instance to be the size of the model
-        pad_file(
-            train_entity_path=f"{model_path}/{ENTITY_FILE}",
-            test_entity_path=f"{ENCODING_PATH}/{token}/{ENTITY_FILE}",
-        )
+        prepare_encodings(test_path, f"{ENCODING_PATH}/{token}", model_path, randomize)
 
         # run the test instance against the model
-        test_output = subprocess.run(
-            [
-                "python3.6",
-                "driver.py",
-                "--dataset",
-                str(token),
-                "--epoch",
-                str(0),
-                "--show_val",
-                "--show_test",
-                "--threshold",
-                str(threshold),
-                "--pretrain",
-                str(2),
-                "--test_size",
-                str(0.99999),
-                "--val_size",
-                str(0.0),
-            ],
-            cwd=GNN_PATH,
-            stderr=subprocess.PIPE,
-            check=False,
-        )
-
-        # example lines from output:
-        #
-        # ...
-        # 2021-11-24 19:43:41,785 |   INFO | metrics: tn_b, value: 55
-        # 2021-11-24 19:43:41,785 |   INFO | metrics: fp_b, value: 7
         try:
-            true_negative, false_positive = (
-                int(val[val.rindex(":") + 2 : val.rindex("\x1b")])
-                for val in test_output.stderr.decode().splitlines()[-2:]
-            )
-
-            if benign:
-                tn, fp, tp, fn = true_negative, false_positive, 0, 0
+            if server is not None:
+                result = shadewatcher_client.score(
+                    server, os.path.abspath(f"{ENCODING_PATH}/{token}"), threshold
+                )
+                true_negative, false_positive = result["tn_b"], result["fp_b"]
             else:
-                tn, fp, tp, fn = 0, 0, false_positive, true_negative
+                true_negative, false_positive = run_driver(token, threshold)
 
-            print(f"[fp: {fp}] [tn: {tn}] [tp: {tp}] [fn: {fn}]", file=sys.stderr)
-
-            # save the results the a file
-            with open(output_file_path, "a", encoding="utf-8") as output_file:
-                print(
-                    f"{stringify_path(test_path)},{tn},{fp},{tp},{fn}",
-                    file=output_file,
-                )
+            write_result(output_file_path, test_path, true_negative, false_positive, benign)
         except Exception as ex:
             if "LOG_ERR" in os.environ:
-                print("Error:", ex, test_output.stderr.decode(), sep="\n", file=sys.stderr)
+                print("Error:", ex, sep="\n", file=sys.stderr)
             else:
                 print("fail...", file=sys.stderr)
             issue_count += 1
@@ -187,6 +302,21 @@ if __name__ == "__main__":
         type=float,
         default=1.5,
     )
+    parser.add_argument(
+        "--single_process",
+        help="evaluate all graphs in one gnn process that restores the model once",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch_graphs",
+        help="number of graphs propagated at once with --single_process",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--server",
+        help="url of a scoring service holding the model (see shadewatcher_client.py)",
+    )
     args = parser.parse_args()
 
     print(args, file=sys.stderr)
@@ -206,6 +336,9 @@ if __name__ == "__main__":
             benign=args.benign,
             token=args.token,
             threshold=args.threshold,
+            server=args.server,
+            single_process=args.single_process,
+            batch_graphs=args.batch_graphs,
         )
     else:
         evaluate(
@@ -215,4 +348,7 @@ if __name__ == "__main__":
             randomize=args.randomize,
             benign=args.benign,
             threshold=args.threshold,
+            server=args.server,
+            single_process=args.single_process,
+            batch_graphs=args.batch_graphs,
         )